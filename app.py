@@ -1,16 +1,33 @@
-from shiny import App, Inputs, Outputs, Session, ui, render
-import matplotlib.pyplot as plt
-import plotly.express as px
+import startup_timing  # Imported first so the startup report covers every import below
+import asyncio
+import json
+import os
+from startup_timing import lazy_import
+from shiny import App, Inputs, Outputs, Session, ui, render, req
 import pandas as pd  # Import pandas here
 from shinywidgets import output_widget, render_widget
 import shinyswatch
-from palmerpenguins import load_penguins 
-import seaborn as sns
 from shiny import reactive
-import ipyleaflet as ipyl
+from starlette.applications import Starlette
+from starlette.routing import Mount, Route
+from dataset_source import DatasetSource
+from dataset_stream import STREAM_INTERVAL_ENV, DatasetStream
+from input_coalescing import debounce, throttle
+from island_map import IslandLayer, describe_island, map_mode
+from instrumentation import count_input_invalidations, instrumented, metrics, phase
+from figure_cache import FigureCache
+from render_pool import RenderPool
+from histogram_engine import histogram_png, histogram_traces
+from output_renders import (
+    Engines, histogram_counts, histogram_figure, paged_table, plot_counts, plot_title, scatter_figure, scatter_points, summary_rows,
+)
+from scatter_engine import SCATTER_UPDATE_MAX_POINTS, scatter_traces
+from tile_cache import TileCache
+from widget_payload import WidgetBundle, compact_figure
+from species_index import SpeciesIndex
 
-# Load the Palmer Penguins dataset
-penguins = load_penguins()  # Correctly load the dataset
+# matplotlib, plotly and ipyleaflet are imported by the outputs that use them, on first render
+startup_timing.mark("imports")
 
 # Define a dictionary for display names mapped to column names
 column_choices = {
@@ -20,6 +37,31 @@ column_choices = {
     "Bill Depth (mm)": "bill_depth_mm"
 }
 
+# Load the dataset (Palmer Penguins unless PENGUINS_DATA points at a file) from the shared columnar cache,
+# and index its rows by species once at load time
+dataset = DatasetSource.from_environment()
+species_index = SpeciesIndex(dataset.load(column_choices))
+penguins = species_index.data  # Species column is categorical
+
+# Filters, statistics, histogram and scatter engines, the cross filter and the table pager, shared across sessions.
+# The outputs' render paths are functions of them in output_renders.py, which bench_outputs.py times.
+engines = Engines(species_index, column_choices.values())
+species_filter, stats_index, histogram_engine = engines.species_filter, engines.stats, engines.histograms
+scatter_engine, cross_filter, table_pager = engines.scatter, engines.cross_filter, engines.tables
+metrics.register_cache("cross_filter", cross_filter.stats)
+
+# Rendered figures shared across sessions, keyed by every input that shapes them and the dataset version
+figure_cache = FigureCache()
+metrics.register_cache("figures", figure_cache.stats)
+
+# Renders on the event loop, or off it in bounded worker pools with PENGUINS_RENDER_MODE=pool
+render_pool = RenderPool()
+
+# Plotly widgets' JavaScript, sent with each widget or imported by URL with PENGUINS_WIDGET_BUNDLE=url
+widget_bundle = WidgetBundle()
+
+startup_timing.mark("dataset load")
+
 # Define custom colors for each species
 color_map = {
     "Adelie": "#1f77b4",  # Blue
@@ -34,9 +76,93 @@ island_coordinates = {
     "Torgersen Island": (-64.0, -63.0)
 }
 
+# The map's starting view, and the zoom used when an island is selected
+MAP_CENTER = (-64.5, -63.0)
+MAP_ZOOM = 10
+ISLAND_ZOOM = 13
+
+# The area the map can show when the app serves its tiles: ((south, west), (north, east)) around the islands,
+# and the zoom levels it can be viewed at
+MAP_BOUNDS = ((-67.0, -68.0), (-62.0, -58.0))
+MAP_MIN_ZOOM, MAP_MAX_ZOOM = 6, 16
+
+# Map tiles and the marker icon, served from a local disk cache with PENGUINS_TILE_MODE=local or offline
+tile_cache = TileCache(bounds=MAP_BOUNDS, min_zoom=MAP_MIN_ZOOM, max_zoom=MAP_MAX_ZOOM)
+metrics.register_cache("tiles", tile_cache.stats)
+
+# Map zoom and center for the selected island, or the starting view
+def island_view(island):
+    if island in island_coordinates:
+        return ISLAND_ZOOM, island_coordinates[island]
+    return MAP_ZOOM, MAP_CENTER
+
+
+# Penguin counts and mean measurements per island for the map's island layer, shared by all sessions.
+# PENGUINS_MAP_MODE=geojson draws the islands with that layer alone, without icon markers.
+MAP_MODE = map_mode()
+island_layer = IslandLayer(species_index, island_coordinates, color_map, column_choices)
+metrics.register_cache("island_layer", island_layer.cache.stats)
+ISLAND_LAYER_NAME = "Penguins per island"
+
+# Rows appended to the dataset while the app runs are merged into the shared engines incrementally.
+# dataset_version is a reactive value shared by every session; it changes with each appended batch,
+# whether a followed CSV file grew or another producer called dataset_stream.append.
+# Only a followed CSV file is polled, since every poll wakes up every session.
+dataset_stream = DatasetStream(
+    dataset, species_index,
+    engines=[stats_index, histogram_engine, scatter_engine, island_layer, cross_filter], caches=[species_filter, table_pager],
+    column_choices=column_choices,
+)
+dataset_version = reactive.value(dataset_stream.version)
+sessions_loop = None  # The event loop the sessions run on, recorded by the first one
+
+
+# Called after every appended batch, from the thread that appended it: the new version is set on the event loop
+# and flushed to the sessions like any other reactive change
+def publish_dataset_version():
+    if sessions_loop is None:
+        dataset_version.set(dataset_stream.version)  # No session to tell yet
+        return
+
+    async def set_version():
+        async with reactive.lock():
+            dataset_version.set(dataset_stream.version)
+            await reactive.flush()
+
+    asyncio.run_coroutine_threadsafe(set_version(), sessions_loop)
+
+
+dataset_stream.listeners.append(publish_dataset_version)
+
+if dataset_stream.follow:
+    # Appended lines are picked up here and published like any other batch
+    @reactive.poll(dataset_stream.update, float(os.environ.get(STREAM_INTERVAL_ENV, 5)))
+    def followed_version():
+        return dataset_stream.version
+
 # Extract the display names and use them as choices
 display_names = list(column_choices.keys())
 
+# Inputs whose invalidations are counted in the render metrics
+sidebar_inputs = [
+    "n", "selected_attribute", "multi_choice_input", "show_all",
+    "x_column", "numeric", "multi_choice_PlotlyH", "show_all_PlotlyH", "single_color",
+    "x_column_scatter", "y_column_scatter", "species_input", "scatter_mode",
+    "species_input_df_dt", "table_sort_column", "table_descending", "table_filter_column",
+    "table_filter_value", "table_page_size", "table_page", "center",
+]
+
+# Seconds between renders while the bin slider is dragged, and of quiet after typing before rendering
+SLIDER_THROTTLE_S = 0.5
+TYPING_DEBOUNCE_S = 0.6
+
+# Plotly bin count used while the numeric input is empty, its starting value, and its largest
+PLOTLY_DEFAULT_BINS = 20
+PLOTLY_MAX_BINS = 100
+
+# Range of the Seaborn bin slider
+SEABORN_MIN_BINS, SEABORN_MAX_BINS = 1, 50
+
 app_ui = ui.page_fluid(
     ui.tags.head(
         ui.tags.style(""" 
@@ -82,7 +208,7 @@ app_ui = ui.page_fluid(
                     
                     #Seaborn Sidebar
                     ui.h3("Seaborn Histogram Inputs"),
-                    ui.input_slider("n", "Seaborn Bin Count", 1, 50, 25),
+                    ui.input_slider("n", "Seaborn Bin Count", SEABORN_MIN_BINS, SEABORN_MAX_BINS, 25),
                     ui.input_selectize(
                         "selected_attribute",  # Name of the input
                         "Select a column for X-axis:",  # Label for the input
@@ -111,7 +237,7 @@ app_ui = ui.page_fluid(
                         choices=display_names,  # Display names in dropdown
                         selected="Body Mass (g)"
                     ),
-                    ui.input_numeric("numeric", "Number of bins", 20, min=1, max=100),  
+                    ui.input_numeric("numeric", "Number of bins", PLOTLY_DEFAULT_BINS, min=1, max=PLOTLY_MAX_BINS),  
                     ui.input_checkbox_group( 
                         "multi_choice_PlotlyH",
                         "Select One or More Penguin Species to Display:",
@@ -151,6 +277,16 @@ app_ui = ui.page_fluid(
                         selected=["Adelie", "Chinstrap", "Gentoo"],
                         inline=False
                     ),
+                    ui.input_select(
+                        "scatter_mode",
+                        "Large Data Mode:",
+                        choices={
+                            "auto": "All points (WebGL for large data)",
+                            "sample": "Downsampled points",
+                            "binned": "2D binned density",
+                        },
+                        selected="auto"
+                    ),
                     ui.hr(style="border-top: 4px solid #f75c03;"),
                     ui.h3("Data Frame & Data Table Filter"),
                     ui.input_checkbox_group( 
@@ -160,6 +296,25 @@ app_ui = ui.page_fluid(
                         selected=["Adelie", "Chinstrap", "Gentoo"],
                         inline=False
                     ),
+                    ui.input_select(
+                        "table_sort_column",
+                        "Sort by:",
+                        choices={"": "Row order", **{column: column for column in penguins.columns}}
+                    ),
+                    ui.input_checkbox("table_descending", "Sort Descending"),
+                    ui.input_select(
+                        "table_filter_column",
+                        "Filter column:",
+                        choices=list(penguins.columns),
+                        selected="island"
+                    ),
+                    ui.input_text(
+                        "table_filter_value",
+                        "Filter value (text, or >4000, 3000..4000 for numbers):",
+                        ""
+                    ),
+                    ui.input_select("table_page_size", "Rows per page:", choices=["25", "50", "100", "250"], selected="25"),
+                    ui.input_numeric("table_page", "Page", 1, min=1),
                     ui.hr(style="border-top: 4px solid #f75c03;"),
                     ui.a("GitHub", href="https://github.com/dennykami1/cintel-02-data", target="_blank"),
                     class_="sidebar-custom"  # Apply custom sidebar class              
@@ -175,7 +330,7 @@ app_ui = ui.page_fluid(
                     ui.layout_columns(
                         ui.card(
                             ui.h2("Seaborn Histogram"),
-                            ui.output_plot("plot"),     
+                            ui.output_image("plot"),     
                         ),
                         ui.card(
                             ui.h2("Plotly Histogram"),
@@ -204,6 +359,11 @@ app_ui = ui.page_fluid(
             ), 
             ui.card(
                 ui.card_header("Palmer Penguins Data Frame & Data Grid", style="background-color: #8ecae6; color: #14213d;"),
+                ui.output_text("table_page_info"),
+                ui.card(
+                    ui.h2("Summary Statistics"),
+                    ui.output_data_frame("species_summary"),
+                ),
                 ui.layout_columns(
                     ui.card(
                         ui.column(
@@ -233,196 +393,388 @@ app_ui = ui.page_fluid(
     ),
     theme=shinyswatch.theme.lumen
 )
+startup_timing.mark("ui build")
 
 def server(input, output, session):
+    global sessions_loop
+    sessions_loop = asyncio.get_running_loop()
 
-    # Create the map widget globally so it can be accessed in reactive updates
-    imagery_map = ipyl.Map(zoom=10, center=(-64.5, -63.0))
-    
-    # Add satellite imagery layer
-    imagery_layer = ipyl.TileLayer(
-        url='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-        attribution='&copy; <a href="https://www.esri.com/">ESRI</a>',
-        name='Satellite Imagery'
-    )
-    imagery_map.add_layer(imagery_layer)
-    
-    # Create a penguin icon
-    penguin_icon_url = "https://cdn.pixabay.com/photo/2024/03/27/17/35/penguin-8659564_1280.png"
-    penguin_icon = ipyl.Icon(icon_url=penguin_icon_url, icon_size=(45, 45))
-    
-    # Add markers for each island
-    for island, coords in island_coordinates.items():
-        penguin_marker = ipyl.Marker(location=coords, icon=penguin_icon, draggable=False)
-        imagery_map.add_layer(penguin_marker)
-    
-    # Output the map widget
+    # Count how often each sidebar input invalidates the outputs that read it
+    count_input_invalidations(input, sidebar_inputs)
+
+    # --------------------------------------------------------
+    # Reactive calculations
+    # --------------------------------------------------------
+
+    # The Plotly widgets take appended rows as trace updates, so they read the version without depending on it.
+    # rebuild_widgets is bumped when an update can't be applied to the existing traces.
+    def isolated_version():
+        with reactive.isolate():
+            return dataset_version()
+
+    rebuild_widgets = reactive.value(0)
+
+    # Coalesce rapid input changes so only the latest value is rendered.
+    # Dragging the slider renders at most once per window; typed values render once typing pauses,
+    # so a half-typed bin count or filter never reaches the outputs.
+    # Bin counts are clamped to their input's range, since a client can send any value.
+    @throttle(SLIDER_THROTTLE_S)
+    def seaborn_bins():
+        return min(max(SEABORN_MIN_BINS, int(input.n())), SEABORN_MAX_BINS)
+
+    # A cleared bin count falls back to the default, like px.histogram(nbins=None) did
+    @debounce(TYPING_DEBOUNCE_S)
+    def plotly_bins():
+        bins = input.numeric()
+        return min(max(1, int(bins)), PLOTLY_MAX_BINS) if bins else PLOTLY_DEFAULT_BINS
+
+    @debounce(TYPING_DEBOUNCE_S)
+    def table_filter_value():
+        return input.table_filter_value()
+
+    # A box drawn in the scatter plot, as its (column, low, high) ranges and the species it was drawn over,
+    # or None. The histograms and tables show only the rows inside it.
+    brush = reactive.value(None)
+
+    # The tables page through the filtered view on the server, so only the visible rows are sent
+    @reactive.calc
+    def table_page():
+        dataset_version()  # Appended rows change the pages
+        return paged_table(
+            engines,
+            input.species_input_df_dt(),
+            input.table_page() or 1,
+            int(input.table_page_size()),
+            sort_column=input.table_sort_column(),
+            descending=input.table_descending(),
+            filter_column=input.table_filter_column(),
+            filter_value=table_filter_value(),
+            current_brush=brush(),
+        )
+
+    # Output the map widget; it is only built once its card renders
     @output
     @render_widget
+    @instrumented
     def map():
+        ipyl = lazy_import("ipyleaflet")
+        # Open at the selected island's view, so the centering effect below has nothing to send after the first render
+        with reactive.isolate():
+            zoom, center = island_view(input.center())
+        limits = tile_cache.layer_limits
+        imagery_map = ipyl.Map(zoom=zoom, center=center, **{name: limits[name] for name in ("min_zoom", "max_zoom") if name in limits})
+    
+        # Add satellite imagery layer (served by the app itself unless the tile mode is remote, and then kept to its area)
+        imagery_layer = ipyl.TileLayer(
+            url=tile_cache.tile_url,
+            attribution='&copy; <a href="https://www.esri.com/">ESRI</a>',
+            name='Satellite Imagery',
+            **limits,
+        )
+        imagery_map.add_layer(imagery_layer)
+
+        # Circles sized by the selected species' penguins on each island; hovering one shows its counts and means
+        ipyw = lazy_import("ipywidgets")
+        with reactive.isolate():
+            islands = ipyl.GeoJSON(data=island_layer.features(input.species_input()), name=ISLAND_LAYER_NAME)
+        island_info = ipyw.HTML("Hover over an island")
+        islands.on_hover(lambda feature, **kwargs: setattr(island_info, "value", describe_island(feature["properties"])))
+        imagery_map.add_layer(islands)
+        imagery_map.add_control(ipyl.WidgetControl(widget=island_info, position="bottomleft"))
+        if MAP_MODE == "geojson":
+            return imagery_map
+    
+        # Create a penguin icon
+        penguin_icon = ipyl.Icon(icon_url=tile_cache.icon_url, icon_size=(45, 45))
+    
+        # Add markers for each island
+        for island, coords in island_coordinates.items():
+            penguin_marker = ipyl.Marker(location=coords, icon=penguin_icon, draggable=False)
+            imagery_map.add_layer(penguin_marker)
+
         return imagery_map
 
     # Reactive effect to update the map center when an island is selected
     @reactive.Effect
     def _():
-        selected_island = input.center()
-        if selected_island in island_coordinates:
-            imagery_map.center = island_coordinates[selected_island]
-            imagery_map.zoom = 13  # Adjust zoom level for better visibility
+        zoom, center = island_view(input.center())
+        imagery_map = map.widget  # Waits until the map has rendered
+        # Center and zoom go to the browser in one message, and not at all when they haven't changed
+        with imagery_map.hold_sync():
+            imagery_map.center = center
+            imagery_map.zoom = zoom  # Adjust zoom level for better visibility
+
+    # A species selection or appended rows reach the island layer as one data update, from the shared cache
+    @reactive.Effect
+    def _():
+        dataset_version()
+        features = island_layer.features(input.species_input())
+        imagery_map = map.widget
+        for layer in imagery_map.layers:
+            if layer.name == ISLAND_LAYER_NAME:
+                layer.data = features
     
-    @render.plot(alt="A Seaborn histogram on penguin data.")  
-    def plot():
+    # The Seaborn histogram and the Plotly figures render in extended tasks. Shiny's reactive lock covers every
+    # session on the worker and is held while an output awaits, so awaiting a render in the output would hold up
+    # every session; a task runs outside the lock, concurrently with other tasks and sessions.
+    # An effect reads the inputs and starts the task, the output shows its latest result,
+    # and newer inputs cancel the render still in flight. Each task records the metrics of its output.
+    def restart(task, *args):
+        task.cancel()
+        task.invoke(*args)
+
+    @reactive.extended_task
+    @instrumented(name="plot")
+    async def plot_task(key, column, display_name, selected_species, bins, show_all, current_brush, warning, size):
+        width, height, pixelratio = size
+
+        async def render_png():
+            # Pre-aggregated counts and the KDE, from the brushed rows when there is a brush
+            hist, kde = plot_counts(engines, column, selected_species, bins, show_all, current_brush)
+
+            # Rasterized in a worker process in pool mode
+            with phase("build"):
+                return await render_pool.in_process(
+                    session, histogram_png, hist, color_map, kde=kde, xlabel=display_name,
+                    title=plot_title(current_brush), warning=warning, width=width, height=height, pixelratio=pixelratio,
+                )
+
+        return {
+            "src": await figure_cache.png_file_async(key, render_png),
+            "width": f"{width}px", "height": f"{height}px",
+            "alt": "A Seaborn histogram on penguin data.",
+        }
+
+    @reactive.effect
+    def _():
         selected_display_name = input.selected_attribute()
         selected_column = column_choices[selected_display_name]
         selected_species = input.multi_choice_input()
+        req(selected_species)  # The output reports an empty selection
 
+        # Fall back to body mass when the selected column can't be binned
+        warning = None
+        if selected_column not in penguins.columns:
+            warning = 'Column not found!'
+        elif not pd.api.types.is_numeric_dtype(penguins[selected_column]):
+            warning = 'Selected column is not numeric.'
+        if warning:
+            selected_column, selected_display_name = "body_mass_g", "Body Mass (g)"
+
+        # Render at the output's size, rounded so nearby sizes share a cached PNG
+        width = round((session.clientdata.output_width("plot") or 500) / 25) * 25
+        height = round((session.clientdata.output_height("plot") or 400) / 25) * 25
+        pixelratio = session.clientdata.pixelratio() or 1
+        bins, show_all = seaborn_bins(), input.show_all()
+        current_brush = brush()
+
+        key = ("plot", dataset_version(), selected_column, frozenset(selected_species), bins, show_all, current_brush, width, height, pixelratio)
+        restart(
+            plot_task, key, selected_column, selected_display_name, selected_species, bins, show_all, current_brush, warning,
+            (width, height, pixelratio),
+        )
+
+    @render.image
+    def plot():
         # Ensure at least one species is selected
-        if not selected_species:
+        if not input.multi_choice_input():
             raise ValueError("Please select at least one species.")
+        return plot_task.result()
 
-        # Filter penguins DataFrame based on selected species
-        filtered_penguins = penguins[penguins['species'].isin(selected_species)]
-
-        # Determine overlay based on checkbox
-        multiple_mode = "layer" if not input.show_all() else "stack"
+    # Built and serialized in a worker thread in pool mode
+    @reactive.extended_task
+    @instrumented(name="penguins_histogram")
+    async def histogram_task(key, build_figure):
+        return await figure_cache.plotly_json_async(key, lambda: render_pool.in_thread(session, lambda: compact_figure(build_figure())))
 
-        # Plotting with the selected settings
-        if selected_column in filtered_penguins.columns:
-            if pd.api.types.is_numeric_dtype(filtered_penguins[selected_column]):
-                ax = sns.histplot(
-                    data=filtered_penguins, x=selected_column, bins=input.n(),
-                    hue="species" if not input.show_all() else None,
-                    palette=color_map, multiple=multiple_mode, kde=True
-                )
-                ax.set_title("Palmer Penguins")
-                ax.set_xlabel(selected_display_name)
-                ax.set_ylabel("Count")
-            else:
-                ax = sns.histplot(
-                    data=filtered_penguins, x="body_mass_g", bins=input.n(),
-                    hue="species" if not input.show_all() else None,
-                    palette=color_map, multiple=multiple_mode, kde=True
-                )
-                ax.set_title("Palmer Penguins")
-                ax.set_xlabel("Body Mass (g)")
-                ax.set_ylabel("Count")
-                ax.text(0.5, 0.5, 'Selected column is not numeric.',
-                        horizontalalignment='center', verticalalignment='center',
-                        transform=ax.transAxes, fontsize=12, color='purple')
-        else:
-            ax = sns.histplot(
-                data=filtered_penguins, x="body_mass_g", bins=input.n(),
-                hue="species" if not input.show_all() else None,
-                palette=color_map, multiple=multiple_mode, kde=True
-            )
-            ax.set_title("Palmer Penguins")
-            ax.set_xlabel("Body Mass (g)")
-            ax.set_ylabel("Count")
-            ax.text(0.5, 0.5, 'Column not found!',
-                    horizontalalignment='center', verticalalignment='center',
-                    transform=ax.transAxes, fontsize=12, color='purple')
-        
-        return ax
-    
-    @render_widget 
-    def penguins_histogram():  
+    @reactive.effect
+    def _():
         # Map the display name back to the actual column name
-        x_column_name = column_choices[input.x_column()]
+        x_label = input.x_column()
+        x_column_name = column_choices[x_label]
 
-        # Filter the penguins dataset based on selected species
-        selected_species = input.multi_choice_PlotlyH()
-        filtered_penguins = penguins[penguins["species"].isin(selected_species)]
+        selected_species, bins, single_color_only = input.multi_choice_PlotlyH(), plotly_bins(), input.single_color()
 
         # Define color for single color option
         single_color = "#636EFA"  # Default color (you can change this)
 
-        # Check if the user wants to show all species without overlay
-        if input.show_all_PlotlyH():
-            # Create histogram plot without overlay for selected species
-            histogram = px.histogram(
-                data_frame=filtered_penguins,
-                x=x_column_name,  # Dynamic x-axis based on actual column name
-                nbins=input.numeric(),
-                color="species" if not input.single_color() else None,  # Conditional color
-                barmode="group",  # Group the bars side by side
-                color_discrete_map=color_map if not input.single_color() else {"All": single_color}  # Use the custom color map or single color
-            ).update_layout(
-                title={"text": f"Penguin {input.x_column()} Distribution by Species", "x": 0.5},
-                yaxis_title="Count",
-                xaxis_title=input.x_column(),
-            )
-        else:
-            # Create histogram plot based on selected x-axis column with species overlay and custom colors
-            histogram = px.histogram(
-                data_frame=filtered_penguins,
-                x=x_column_name,  # Dynamic x-axis based on actual column name
-                nbins=input.numeric(),
-                color="species" if not input.single_color() else None,  # Conditional color
-                barmode="overlay",  # Overlay the bars instead of stacking
-                color_discrete_map=color_map if not input.single_color() else {"All": single_color}  # Use the custom color map or single color
-            ).update_layout(
-                title={"text": f"Penguin {input.x_column()} Distribution by Species", "x": 0.5},
-                yaxis_title="Count",
-                xaxis_title=input.x_column(),
+        # Group the bars side by side without overlay, otherwise overlay them
+        barmode = "group" if input.show_all_PlotlyH() else "overlay"
+        rebuild_widgets()
+        # A new brush reaches the open widget as new bar heights (see below)
+        with reactive.isolate():
+            current_brush = brush()
+
+        # Pre-aggregated counts for the selected species, one bar per bin and series
+        def build_figure():
+            return histogram_figure(
+                engines, x_column_name, x_label, selected_species, bins, barmode, single_color_only, current_brush, color_map,
+                single_color=single_color,
             )
 
-        return histogram 
-    
-    @render_widget 
-    def penguins_scatter_plot():  
-        # Map the display names back to the actual column names
-        x_column_name = column_choices[input.x_column_scatter()]
-        y_column_name = column_choices[input.y_column_scatter()]
-
-        # Filter the penguins dataset based on selected species
-        selected_species = input.species_input()
-        filtered_penguins = penguins[penguins["species"].isin(selected_species)]
-
-        # Create scatter plot
-        scatterplot = px.scatter(
-            data_frame=filtered_penguins,
-            x=x_column_name,  # X-axis based on user selection
-            y=y_column_name,  # Y-axis based on user selection
-            color="species",  # Color points by species
-            color_discrete_map=color_map,  # Use the custom color map
-            title=f"{input.x_column_scatter()} vs {input.y_column_scatter()}",
-            labels={x_column_name: input.x_column_scatter(), y_column_name: input.y_column_scatter()}  # Custom labels for axes
-        ).update_layout(
-            title={"text": f"{input.x_column_scatter()} vs {input.y_column_scatter()}", "x": 0.5},
-            yaxis_title=input.y_column_scatter(),
-            xaxis_title=input.x_column_scatter(),
-        )
+        key = ("penguins_histogram", isolated_version(), x_column_name, frozenset(selected_species), bins, barmode, single_color_only, current_brush)
+        restart(histogram_task, key, build_figure)
+
+    @render_widget
+    def penguins_histogram():
+        histogram = widget_bundle.figure_widget(json.loads(histogram_task.result()), session.clientdata)
+
+        return histogram
+
+    @reactive.extended_task
+    @instrumented(name="penguins_scatter_plot")
+    async def scatter_task(key, x_label, y_label, species, mode):
+        # Per-species points from the shared engine, which keeps them up to date as rows are appended
+        points = scatter_points(engines, column_choices[x_label], column_choices[y_label], species)
+
+        # Create scatter plot; large selections switch to WebGL, downsampling or 2D bins
+        def build_figure():
+            return scatter_figure(points, color_map, mode, x_label, y_label)
+
+        figure_json = await figure_cache.plotly_json_async(key, lambda: render_pool.in_thread(session, lambda: compact_figure(build_figure())))
+        return figure_json, (x_label, y_label, species, mode)
+
+    @reactive.effect
+    def _():
+        x_label = input.x_column_scatter()
+        y_label = input.y_column_scatter()
+        mode = input.scatter_mode()
+        species = input.species_input()
+        rebuild_widgets()
+        brush.set(None)  # The new widget starts without a selection
+        key = ("penguins_scatter_plot", isolated_version(), x_label, y_label, frozenset(species), mode)
+        restart(scatter_task, key, x_label, y_label, species, mode)
+
+    @render_widget
+    def penguins_scatter_plot():
+        # The inputs the figure was built for come with it, so the callbacks below match what is drawn
+        figure_json, (x_label, y_label, species, mode) = scatter_task.result()
+        scatterplot = widget_bundle.figure_widget(json.loads(figure_json), session.clientdata)
+
+        # Zooming re-fetches full-resolution points (or finer bins) for the visible viewport
+        if mode != "auto":
+            def refetch_viewport(layout, x_range, y_range):
+                # Read the points again, since rows may have been appended since the render
+                current_points = scatter_engine.points(column_choices[x_label], column_choices[y_label], species)
+                traces = scatter_traces(current_points, color_map, mode, x_range=x_range, y_range=y_range)
+                with scatterplot.batch_update():
+                    for trace, viewport_trace in zip(scatterplot.data, traces):
+                        trace.x, trace.y = viewport_trace.x, viewport_trace.y
+                        if mode == "binned":
+                            trace.z = viewport_trace.z
+
+            scatterplot.layout.on_change(refetch_viewport, "xaxis.range", "yaxis.range")
+
+        # A box selection cross-filters the histograms and tables; double-clicking to clear it shows every row again.
+        # Every trace gets the event, so listening on the first is enough.
+        def select_region(trace, points, selector):
+            if selector is not None and hasattr(selector, "xrange"):
+                x_low, x_high = sorted(selector.xrange)
+                y_low, y_high = sorted(selector.yrange)
+                ranges = ((column_choices[x_label], x_low, x_high), (column_choices[y_label], y_low, y_high))
+                brush.set((ranges, frozenset(species)))
+
+        if scatterplot.data and mode != "binned":
+            scatterplot.data[0].on_selection(select_region)
+            scatterplot.data[0].on_deselect(lambda trace, points: brush.set(None))
 
         return scatterplot
 
+    # A new brush reaches the open Plotly histogram as new bar heights on the same bins
+    @reactive.effect
+    @reactive.event(brush, ignore_init=True)
+    def _():
+        histogram = penguins_histogram.widget
+        if histogram is not None and plotly_bins():
+            hist = histogram_counts(
+                engines, column_choices[input.x_column()], input.multi_choice_PlotlyH(), plotly_bins(), input.single_color(), brush()
+            )
+            update_traces(histogram, histogram_traces(hist, color_map, "overlay"), ["y"])
+
+    # Appended rows reach the Plotly widgets as updates to their existing traces rather than whole new figures.
+    # Histograms send their new bar positions and heights, scatter plots their merged points (or bins)
+    # unless there are too many of them, when the widgets are re-rendered instead.
+    @reactive.effect
+    @reactive.event(dataset_version, ignore_init=True)
+    def _():
+        histogram = penguins_histogram.widget
+        if histogram is not None and plotly_bins():
+            hist = histogram_counts(
+                engines, column_choices[input.x_column()], input.multi_choice_PlotlyH(), plotly_bins(), input.single_color(), brush()
+            )
+            barmode = "group" if input.show_all_PlotlyH() else "overlay"
+            update_traces(histogram, histogram_traces(hist, color_map, barmode), ["x", "y", "width"])
+
+        scatterplot = penguins_scatter_plot.widget
+        if scatterplot is not None:
+            mode = input.scatter_mode()
+            points = scatter_engine.points(
+                column_choices[input.x_column_scatter()], column_choices[input.y_column_scatter()], input.species_input()
+            )
+            # Keep the current zoom in the modes that render the viewport
+            x_range = scatterplot.layout.xaxis.range if mode != "auto" else None
+            y_range = scatterplot.layout.yaxis.range if mode != "auto" else None
+            traces = scatter_traces(points, color_map, mode, x_range=x_range, y_range=y_range)
+            if sum(len(trace.x) for trace in traces if trace.x is not None) > SCATTER_UPDATE_MAX_POINTS:
+                rebuild_widgets.set(rebuild_widgets() + 1)
+            else:
+                update_traces(scatterplot, traces, ["x", "y", "z"] if mode == "binned" else ["x", "y"])
+
+    # Copy properties from new traces onto a widget's traces in one message,
+    # or re-render the widgets when the traces no longer line up (e.g. a new species appeared)
+    def update_traces(figure, traces, properties):
+        if len(figure.data) != len(traces):
+            rebuild_widgets.set(rebuild_widgets() + 1)
+            return
+        with figure.batch_update():
+            for trace, new_trace in zip(figure.data, traces):
+                for name in properties:
+                    trace[name] = new_trace[name]
+
+    @output
+    @render.text
+    def table_page_info():
+        rows, total, page, page_count = table_page()
+        start = (page - 1) * int(input.table_page_size())
+        return f"Rows {start + 1 if total else 0}-{start + len(rows)} of {total} (page {page} of {page_count})"
+
+    # Count, missing values, range, quartiles and mean per measurement for the selected species,
+    # read from the shared statistics index
     @output
     @render.data_frame
+    @instrumented
+    def species_summary():
+        dataset_version()
+        summary = summary_rows(engines, input.species_input_df_dt())
+        return render.DataGrid(summary)
+
+    @output
+    @render.data_frame
+    @instrumented
     def penguins_df():
-        # Filter the penguins dataset based on selected species
-        selected_species = input.species_input_df_dt()
-        filtered_penguins = penguins[penguins["species"].isin(selected_species)]
-        return render.DataGrid(filtered_penguins)
+        # Shares the current page with penguins_dt
+        with phase("filter"):
+            rows, total, page, page_count = table_page()
+        return render.DataGrid(rows)
 
     @output
     @render.data_frame  
+    @instrumented
     def penguins_dt():
-        # Filter the penguins dataset based on selected species
-        selected_species = input.species_input_df_dt()
-        filtered_penguins = penguins[penguins["species"].isin(selected_species)]
-        return render.DataTable(filtered_penguins)
-
-# --------------------------------------------------------
-# Reactive calculations and effects
-# --------------------------------------------------------
-
-# Add a reactive calculation to filter the data
-# By decorating the function with @reactive, we can use the function to filter the data
-# The function will be called whenever an input functions used to generate that output changes.
-# Any output that depends on the reactive function (e.g., filtered_data()) will be updated when the data changes.
-
-@reactive.calc
-def filtered_data():
-    return penguins
+        # Shares the current page with penguins_df
+        with phase("filter"):
+            rows, total, page, page_count = table_page()
+        return render.DataTable(rows)
 
+shiny_app = App(app_ui, server, debug=True)
 
-app = App(app_ui, server, debug=True)
+# Serve the render metrics as JSON next to the app, and log them periodically
+app = Starlette(routes=[
+    Route("/metrics", metrics.endpoint),
+    Route("/widgets/{name}", widget_bundle.endpoint),
+    Route("/tiles/icons/penguin.png", tile_cache.icon_endpoint),
+    Route("/tiles/{z:int}/{y:int}/{x:int}", tile_cache.tile_endpoint),
+    Mount("/", app=shiny_app),
+])
+metrics.start_periodic_log()
+startup_timing.log_report()
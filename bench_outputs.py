@@ -0,0 +1,223 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_source import DatasetSource, compact_dtypes
+from histogram_engine import histogram_png
+from instrumentation import RenderMetrics, instrumented, phase
+from output_renders import (
+    Engines, histogram_figure, paged_table, plot_counts, plot_title, scatter_figure, scatter_points, summary_rows,
+)
+from species_index import SpeciesIndex
+from startup_timing import lazy_import
+from widget_payload import compact_figure_json
+
+DEFAULT_SIZES = [344, 10_000, 1_000_000, 10_000_000]
+
+MEASUREMENTS = ["bill_length_mm", "bill_depth_mm", "flipper_length_mm", "body_mass_g"]
+ALL_SPECIES = ["Adelie", "Chinstrap", "Gentoo"]
+# Boxes brushed in the scatter plot (body mass against flipper length): about 1% and 20% of the rows
+BRUSHES = [
+    (("body_mass_g", 3900, 4000), ("flipper_length_mm", 190, 195)),
+    (("body_mass_g", 3500, 4500), ("flipper_length_mm", 185, 200)),
+]
+COLORS = {"Adelie": "#1f77b4", "Chinstrap": "#f75c03", "Gentoo": "#801a86"}  # app.py's color_map
+
+
+# A dataset with the Palmer Penguins schema and any number of rows.
+# Species, island and sex are drawn with the real data's frequencies, and each species' measurements
+# from a normal distribution with its real means and covariance, rounded like the real data.
+# Missing values occur at the real data's rates. The same seed always gives the same rows.
+def synthesize_penguins(rows, seed=0):
+    real = DatasetSource(cache_dir=None).read()
+    rng = np.random.default_rng(seed)
+    species = rng.choice(ALL_SPECIES, rows, p=real["species"].value_counts(normalize=True)[ALL_SPECIES].to_numpy())
+    columns = {name: np.full(rows, np.nan) for name in MEASUREMENTS}
+    island = np.empty(rows, dtype=object)
+    for name in ALL_SPECIES:
+        rows_for_species = np.flatnonzero(species == name)
+        measured = real.loc[real["species"] == name, MEASUREMENTS].dropna()
+        samples = rng.multivariate_normal(measured.mean(), measured.cov(), len(rows_for_species))
+        for position, column in enumerate(MEASUREMENTS):
+            columns[column][rows_for_species] = samples[:, position]
+        islands = real.loc[real["species"] == name, "island"].value_counts(normalize=True)
+        island[rows_for_species] = rng.choice(islands.index.to_numpy(), len(rows_for_species), p=islands.to_numpy())
+
+    unmeasured = rng.random(rows) < real["body_mass_g"].isna().mean()
+    for column in MEASUREMENTS:
+        decimals = 1 if column.startswith("bill") else 0
+        columns[column] = np.where(unmeasured, np.nan, np.round(columns[column], decimals))
+    sex = rng.choice(["female", "male"], rows).astype(object)
+    sex[rng.random(rows) < real["sex"].isna().mean()] = None
+
+    return compact_dtypes(pd.DataFrame({
+        "species": species, "island": island, **columns, "sex": sex,
+        "year": rng.choice([2007, 2008, 2009], rows),
+    }))
+
+
+# The outputs of app.py, run headlessly through the same render functions (see output_renders.py).
+# Each returns what its output sends (or the object it is serialized from), so the payload size is comparable;
+# the Plotly outputs also record their figure JSON's size before and after compact_figure_json.
+# Column names stand in for the display names in titles and axis labels, and a brush is drawn over every species.
+def plot(engines, column, species, bins, show_all, brush=None):
+    hist, kde = plot_counts(engines, column, species, bins, show_all, _brush(brush))
+    with phase("build"):
+        return histogram_png(hist, COLORS, kde=kde, xlabel=column, title=plot_title(_brush(brush)))
+
+
+def penguins_histogram(engines, column, species, bins, single_color, brush=None):
+    return compact_figure_json(histogram_figure(engines, column, column, species, bins, "overlay", single_color, _brush(brush), COLORS))
+
+
+def penguins_scatter_plot(engines, x_column, y_column, species, mode):
+    points = scatter_points(engines, x_column, y_column, species)
+    return compact_figure_json(scatter_figure(points, COLORS, mode, x_column, y_column))
+
+
+def penguins_df(engines, species, sort_column, filter_value, brush=None):
+    render = lazy_import("shiny.render")
+    with phase("filter"):
+        rows, total, page, page_count = paged_table(
+            engines, species, 1, 25, sort_column=sort_column, filter_column="body_mass_g", filter_value=filter_value,
+            current_brush=_brush(brush),
+        )
+    return render.DataGrid(rows)
+
+
+def species_summary(engines, species):
+    render = lazy_import("shiny.render")
+    return render.DataGrid(summary_rows(engines, species))
+
+
+def _brush(ranges):
+    return None if ranges is None else (ranges, frozenset(ALL_SPECIES))
+
+
+# Representative inputs for each output: (function, inputs)
+def cases():
+    for species in (ALL_SPECIES, ["Gentoo"]):
+        for column in ("body_mass_g", "bill_length_mm"):
+            for bins in (10, 50):
+                yield plot, dict(column=column, species=species, bins=bins, show_all=False)
+                yield penguins_histogram, dict(column=column, species=species, bins=bins, single_color=False)
+            yield plot, dict(column=column, species=species, bins=25, show_all=True)
+            yield penguins_histogram, dict(column=column, species=species, bins=25, single_color=True)
+        for mode in ("auto", "sample", "binned"):
+            yield penguins_scatter_plot, dict(x_column="body_mass_g", y_column="flipper_length_mm", species=species, mode=mode)
+        for sort_column, filter_value in (("", ""), ("body_mass_g", ""), ("bill_length_mm", ">4000")):
+            yield penguins_df, dict(species=species, sort_column=sort_column, filter_value=filter_value)
+        yield species_summary, dict(species=species)
+    # Cross-filtered by a region brushed in the scatter plot
+    for brush in BRUSHES:
+        yield plot, dict(column="bill_length_mm", species=ALL_SPECIES, bins=25, show_all=False, brush=brush)
+        yield penguins_histogram, dict(column="bill_length_mm", species=ALL_SPECIES, bins=25, single_color=False, brush=brush)
+        for sort_column in ("", "bill_length_mm"):
+            yield penguins_df, dict(species=ALL_SPECIES, sort_column=sort_column, filter_value="", brush=brush)
+
+
+def run(sizes, repeat=3, seed=0, log=print):
+    results = []
+    for size in sizes:
+        start = time.perf_counter()
+        data = synthesize_penguins(size, seed)
+        synthesize_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        engines = Engines(SpeciesIndex(data), MEASUREMENTS)
+        index_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for column in MEASUREMENTS:
+            for species in ALL_SPECIES:
+                engines.stats.get(column, species)
+        stats_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for column in MEASUREMENTS:
+            engines.cross_filter.sorted_index(column)
+        cross_filter_s = time.perf_counter() - start
+        log(
+            f"{size:>10,} rows: synthesized in {synthesize_s:.2f}s, indexed in {index_s:.2f}s, statistics in {stats_s:.2f}s, "
+            f"cross-filter indexes in {cross_filter_s:.2f}s"
+        )
+        results.append({"rows": size, "output": "load", "inputs": {}, "index_s": index_s, "stats_s": stats_s, "cross_filter_s": cross_filter_s})
+
+        for render_fn, inputs in cases():
+            registry = RenderMetrics()
+            timed = instrumented(render_fn, registry=registry)
+            for _ in range(repeat):
+                engines.clear()
+                timed(engines, **inputs)
+            samples = list(registry.samples[render_fn.__name__])
+            fields = sorted({field for sample in samples for field in sample})
+            result = {"rows": size, "output": render_fn.__name__, "inputs": _jsonable(inputs), "repeat": repeat}
+            for field in fields:
+                values = [sample[field] for sample in samples if sample.get(field) is not None]
+                if values:
+                    result[field] = float(np.median(values))
+            results.append(result)
+            log(f"  {render_fn.__name__:<22} {result['wall_s'] * 1000:10.1f} ms  {result.get('payload_bytes', 0):>12,.0f} B  {_describe(inputs)}")
+        del engines, data
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+        "machine": platform.machine(), "processor": platform.processor(),
+    }
+
+
+# Wall time ratio (new / old) for every case present in both result files
+def compare(old, new):
+    def key(result):
+        return result["rows"], result["output"], json.dumps(result["inputs"], sort_keys=True)
+    old_results = {key(result): result for result in old["results"] if "wall_s" in result}
+    for result in new["results"]:
+        previous = old_results.get(key(result))
+        if previous is not None:
+            yield result, previous, result["wall_s"] / previous["wall_s"]
+
+
+def _jsonable(inputs):
+    return {name: list(value) if isinstance(value, (list, tuple)) else value for name, value in inputs.items()}
+
+
+def _describe(inputs):
+    return " ".join(f"{name}={'+'.join(value) if isinstance(value, list) else value}" for name, value in inputs.items())
+
+
+# Time each output's render path at several dataset sizes, with no browser and no network:
+# python bench_outputs.py [--sizes 344,10000] [--repeat 3] [--output bench_output.txt] [--compare old.txt]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the render paths of app.py on synthetic penguin data")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_output.txt", help="JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to compare wall times against")
+    args = parser.parse_args()
+
+    lazy_import("matplotlib").use("Agg")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = {"environment": environment(), "sizes": sizes, "results": run(sizes, args.repeat, args.seed)}
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=1)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as old_file:
+            old = json.load(old_file)
+        print(f"Compared with {old['environment'].get('commit')}:")
+        for result, previous, ratio in compare(old, report):
+            flag = "  slower" if ratio > 1.2 else "  faster" if ratio < 1 / 1.2 else ""
+            print(f"  {result['rows']:>10,} {result['output']:<22} {ratio:6.2f}x{flag}  {_describe(result['inputs'])}")
@@ -0,0 +1,143 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from filter_cache import LRUCache
+
+# Quantiles kept for every column and species
+QUANTILES = (0.25, 0.5, 0.75)
+
+# Megabytes of combined statistics (the sorted values of several species) kept in memory
+STATS_CACHE_MB_ENV = "PENGUINS_STATS_CACHE_MB"
+
+
+# Summary of one column's values for one species (or a set of species):
+# the sorted non-null values, with the counts, range, mean and quantiles taken from them
+class ColumnStats:
+
+    def __init__(self, values, missing=0):
+        self.values = values  # Sorted, without NaN
+        self.count = len(values)
+        self.missing = missing
+        self.min = values[0] if len(values) else None
+        self.max = values[-1] if len(values) else None
+        self.mean = values.mean() if len(values) else None
+        self.quantiles = dict(zip(QUANTILES, np.quantile(values, QUANTILES))) if len(values) else {}
+
+    @classmethod
+    def from_series(cls, series):
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+        missing = np.isnan(values)
+        return cls(np.sort(values[~missing]), int(missing.sum()))
+
+    def merged(self, other):
+        # Stats over both sets of values; merging sorted values avoids sorting them again
+        at = np.searchsorted(self.values, other.values, side="right")
+        return ColumnStats(np.insert(self.values, at, other.values), self.missing + other.missing)
+
+    # Counts per bin, like np.histogram(values, edges), by binary search on the sorted values
+    def counts(self, edges):
+        positions = np.searchsorted(self.values, edges, side="left")
+        positions[-1] = np.searchsorted(self.values, edges[-1], side="right")  # The last bin includes its right edge
+        return np.diff(positions)
+
+
+# (min, max) over some ColumnStats without touching their values, or None when there are none
+def value_range(entries):
+    entries = [entry for entry in entries if entry.count]
+    if not entries:
+        return None
+    return min(entry.min for entry in entries), max(entry.max for entry in entries)
+
+
+# Per-column, per-species statistics shared by every session.
+# Each (column, species) entry is computed on first use and kept until the dataset changes;
+# rows appended to the index are merged into the entries they touch (see extend).
+# Histogram edges, KDEs and the summary table read from here instead of rescanning the data.
+# Entries cover the first `length` rows of the index, which only grows once every entry holds the appended rows,
+# so readers always see entries of one length and an entry computed meanwhile is only kept when it matches.
+class StatsIndex:
+
+    def __init__(self, index, columns, max_entries=64, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(STATS_CACHE_MB_ENV, 512)) * 2 ** 20)
+        self.index = index
+        self.columns = list(columns)
+        self.length = index.length  # Rows covered
+        self.entries = {}  # (column, species) -> ColumnStats
+        # (column, species set, rows covered) -> ColumnStats, bounded by the size of their sorted values
+        self.combined_cache = LRUCache(max_entries, max_bytes=max_bytes, sizeof=lambda entry: entry.values.nbytes)
+        self._lock = threading.Lock()  # Held while appended rows are merged into the entries
+
+    def get(self, column, species):
+        return self.covered(column, [species])[1].get(species) or ColumnStats(np.empty(0))
+
+    def per_species(self, column, selected_species):
+        # species -> ColumnStats for the selected species, in category order
+        return self.covered(column, selected_species)[1]
+
+    # The rows covered and per_species for them; every entry covers the same rows
+    def covered(self, column, selected_species):
+        with self._lock:
+            length = self.length
+            entries = {species: self.entries.get((column, species)) for species in self.index.species if species in selected_species}
+        for species, entry in entries.items():
+            if entry is None:
+                entry = entries[species] = ColumnStats.from_series(self.index.take([species], length)[column])
+                with self._lock:
+                    if self.length == length:  # Otherwise rows were merged in meanwhile, and the entry is missing them
+                        entries[species] = self.entries.setdefault((column, species), entry)
+        return length, entries
+
+    def combined(self, column, selected_species):
+        key = (column, frozenset(selected_species), self.length)
+        return self.combined_cache.get_or_compute(key, lambda: self._combine(*key[:2]))
+
+    def _combine(self, column, selected_species):
+        entries = list(self.per_species(column, selected_species).values())
+        if not entries:
+            return ColumnStats(np.empty(0))
+        values = np.sort(np.concatenate([entry.values for entry in entries]))
+        return ColumnStats(values, sum(entry.missing for entry in entries))
+
+    def value_range(self, column, selected_species):
+        return value_range(self.per_species(column, selected_species).values())
+
+    def extend(self, appended):
+        # Merge rows appended to the index (species -> new row positions) into the entries they touch.
+        # Combined entries without appended rows are kept for the new length.
+        with self._lock:
+            for (column, species), entry in list(self.entries.items()):
+                if species in appended:
+                    new_rows = self.index.data[column].iloc[appended[species]]
+                    self.entries[column, species] = entry.merged(ColumnStats.from_series(new_rows))
+            previous, length = self.length, self.index.length
+            self.combined_cache.refresh(
+                lambda key, entry: None if key[2] != previous or key[1] & appended.keys() else entry,
+                rekey=lambda key: key[:2] + (length,),
+            )
+            self.length = length
+
+    def reset(self):
+        # Drop every entry; they are recomputed from the index on next use
+        with self._lock:
+            self.entries = {}
+            self.length = self.index.length
+        self.combined_cache.clear()
+
+    # One row per selected species and column (plus "All" for several species), rounded for display
+    def summary(self, selected_species, columns=None):
+        rows = []
+        for column in columns or self.columns:
+            groups = self.per_species(column, selected_species)
+            if len(groups) > 1:
+                groups["All"] = self.combined(column, selected_species)
+            for name, entry in groups.items():
+                rows.append({
+                    "column": column, "species": name, "count": entry.count, "missing": entry.missing,
+                    "min": entry.min, **{f"q{int(q * 100)}": value for q, value in entry.quantiles.items()},
+                    "max": entry.max, "mean": entry.mean,
+                })
+        return pd.DataFrame(rows).round(2)
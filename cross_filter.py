@@ -0,0 +1,241 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from filter_cache import LRUCache
+
+# Category columns that get a bitmap per value
+CATEGORY_DIMENSIONS = ("species", "island", "sex")
+
+# A range holding more than 1/SCAN_RATIO of the rows is answered by scanning the columns in order,
+# which beats gathering that many rows at random from the sorted index
+SCAN_RATIO = 16
+
+# Megabytes of cached row sets
+CROSS_FILTER_CACHE_MB_ENV = "PENGUINS_CROSS_FILTER_CACHE_MB"
+
+
+# Row sets for cross-filtering, shared by every session: ranges over measurement columns
+# (the region brushed in the scatter plot) intersected with category filters (an output's species).
+# Each measurement column has a sorted-range index, its row positions in value order, so the rows
+# in a range are two binary searches and a slice. Each category value has a bitmap of its rows
+# packed eight to a byte, and a selection of values is the union of their bitmaps.
+# A narrow range supplies candidate rows that are checked against the other ranges' values and probed
+# in the bitmaps, so the cost grows with the rows brushed rather than the table; a wide one is
+# answered by comparing whole columns and ANDing the bitmaps, a few sequential passes.
+# Bitmaps are built on first use. Sorted-range indexes take seconds at millions of rows, so they are built
+# in a background thread the first time a column is brushed, and ranges over it are scanned until then.
+# Both are merged with appended rows (see extend).
+# Rows are appended to the index before they are merged here, so queries cover the first `length` rows,
+# which only grows once the column values and sorted-range indexes hold the new rows.
+class CrossFilter:
+
+    def __init__(self, index, columns, dimensions=CATEGORY_DIMENSIONS, max_entries=32, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(CROSS_FILTER_CACHE_MB_ENV, 256)) * 2 ** 20)
+        self.index = index
+        self.columns = list(columns)
+        self.dimensions = [dimension for dimension in dimensions if dimension in index.data.columns]
+        self.length = len(index.data)  # Rows covered
+        self.values = {}  # column -> values in row order, NaN for missing ones
+        self.sorted = {}  # column -> (row positions in value order, values in that order), missing values left out
+        self.value_bitmaps = {}  # dimension -> (rows covered, packed bitmap per category)
+        self.bitmaps = LRUCache(max_entries)  # (dimension, selected values, rows covered) -> union of their bitmaps
+        # (ranges, filters, rows covered) -> row positions
+        self.cache = LRUCache(max_entries, max_bytes=max_bytes, sizeof=lambda rows: rows.nbytes)
+        self.scans = 0  # Queries answered by scanning rather than from the sorted index
+        self._lock = threading.Lock()  # Held while a sorted-range index is built or extended
+        self._values_lock = threading.Lock()  # Held while column values are read in or appended rows merged
+        self._building = set()
+
+    # Sorted row positions with every (column, low, high) range's value in [low, high]
+    # and every dimension's value among those given for it, e.g. rows(ranges, species=["Adelie"])
+    def rows(self, ranges=(), **filters):
+        ranges = tuple((column, float(low), float(high)) for column, low, high in ranges)
+        filters = tuple(sorted((dimension, frozenset(values)) for dimension, values in filters.items()))
+        key = (ranges, filters, self.length)
+        return self.cache.get_or_compute(key, lambda: self._rows(*key))
+
+    def _rows(self, ranges, filters, total):
+        if not ranges and not filters:
+            return np.arange(total)
+        unindexed = [column for column, _, _ in ranges if column not in self.sorted]
+        if unindexed:
+            self._index_later(unindexed)
+        elif ranges:
+            bounds = []
+            for column, low, high in ranges:
+                order, values = self.sorted_index(column)
+                # Bounds in the values' own dtype, or searchsorted would copy the values to float64
+                low, high = values.dtype.type(low), values.dtype.type(high)
+                start, stop = np.searchsorted(values, low, side="left"), np.searchsorted(values, high, side="right")
+                bounds.append((stop - start, column, start, stop, order))
+            count, narrowest, start, stop, order = min(bounds, key=lambda bound: bound[:2])
+            if count * SCAN_RATIO <= total:
+                # Candidates from the narrowest range, checked against the others and the bitmaps.
+                # The index may already hold rows appended since total was read.
+                rows = order[start:stop]
+                rows = rows[rows < total]
+                for column, low, high in ranges:
+                    if column != narrowest:
+                        values = self.column_values(column)[rows]
+                        rows = rows[(values >= low) & (values <= high)]
+                for dimension, selected in filters:
+                    bitmap = self.bitmap(dimension, selected, total)
+                    rows = rows[(bitmap[rows >> 3] >> (7 - (rows & 7))) & 1 == 1]
+                return np.sort(rows)
+
+        self.scans += 1
+        keep = np.ones(total, dtype=bool)
+        for column, low, high in ranges:
+            values = self.column_values(column)[:total]
+            keep &= values >= low
+            keep &= values <= high
+        for dimension, selected in filters:
+            keep &= np.unpackbits(self.bitmap(dimension, selected, total), count=total).view(bool)
+        return np.flatnonzero(keep)
+
+    # A column's values for the rows covered, and for rows being merged while extend runs
+    def column_values(self, column):
+        values = self.values.get(column)
+        if values is None:
+            with self._values_lock:
+                if column not in self.values:
+                    self.values[column] = _float_values(self.index.data[column].iloc[:self.length])
+                values = self.values[column]
+        return values
+
+    def sorted_index(self, column):
+        with self._lock:
+            if column not in self.sorted:
+                values = self.column_values(column)
+                present = np.flatnonzero(~np.isnan(values)).astype(_position_dtype(len(values)))
+                order = present[np.argsort(values[present], kind="stable")]
+                self.sorted[column] = (order, values[order])
+            return self.sorted[column]
+
+    def _index_later(self, columns):
+        for column in columns:
+            if column not in self._building:
+                self._building.add(column)
+                threading.Thread(target=self.sorted_index, args=(column,), name=f"cross-filter-{column}", daemon=True).start()
+
+    # The given rows (sorted positions) in the order of a column's values, ties in row order and missing values last,
+    # like table_pager.sort_permutation. Many rows are read off the sorted-range index rather than sorted again.
+    def ordered(self, column, rows, descending=False):
+        # The index is read before the values, which extend grows first, so they cover every row it holds
+        indexed = self.sorted.get(column)
+        all_values = self.column_values(column)
+        total = len(all_values)
+        values = all_values[rows]
+        missing = rows[np.isnan(values)]
+        if len(rows) * SCAN_RATIO <= total or indexed is None:
+            present = ~np.isnan(values)
+            order = np.argsort(values[present], kind="stable")
+            ordered, ordered_values = rows[present][order], values[present][order]
+        else:
+            order, sorted_values = indexed
+            inside = np.zeros(total, dtype=bool)
+            inside[rows] = True
+            keep = inside[order]
+            ordered, ordered_values = order[keep], sorted_values[keep]
+        if descending:
+            # Reversing puts tied rows in reverse row order, so each run of equal values is reversed back
+            ordered, ordered_values = ordered[::-1], ordered_values[::-1]
+            starts = np.flatnonzero(np.r_[True, ordered_values[1:] != ordered_values[:-1]])
+            stops = np.r_[starts[1:], len(ordered)]
+            run = np.repeat(np.arange(len(starts)), stops - starts)
+            ordered = ordered[starts[run] + stops[run] - 1 - np.arange(len(ordered))]
+        return np.concatenate([ordered, missing]).astype(rows.dtype, copy=False)
+
+    # Packed bitmap of the first `total` rows (all rows covered by default) whose dimension value is one of the selected values
+    def bitmap(self, dimension, selected, total=None):
+        key = (dimension, frozenset(selected), self.length if total is None else total)
+        return self.bitmaps.get_or_compute(key, lambda: self._union(*key))
+
+    def _union(self, dimension, selected, total):
+        categories = self._categorical(dimension)
+        covered, value_bitmaps = self.value_bitmaps.get(dimension, (None, None))
+        if covered != total:
+            codes = categories.codes[:total]
+            value_bitmaps = [np.packbits(codes == code) for code in range(len(categories.categories))]
+            self.value_bitmaps[dimension] = (total, value_bitmaps)
+        bitmap = np.zeros((total + 7) // 8, dtype=np.uint8)
+        for code, value in enumerate(categories.categories):
+            if value in selected and code < len(value_bitmaps):
+                bitmap |= value_bitmaps[code]
+        return bitmap
+
+    def _categorical(self, dimension):
+        values = self.index.data[dimension]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values.array
+        return pd.Categorical(values)
+
+    # Non-null values of a column at the given rows, per value of a dimension ("All" when combined)
+    def values_by(self, column, rows, dimension="species", combined=False):
+        values = self.column_values(column)[rows]
+        measured = ~np.isnan(values)
+        if combined:
+            return {"All": values[measured]}
+        categories = self._categorical(dimension)
+        codes = categories.codes[rows][measured]
+        values = values[measured]
+        return {value: values[codes == code] for code, value in enumerate(categories.categories)}
+
+    def extend(self, appended):
+        # Merge rows appended to the index (species -> new row positions) into the column values
+        # and the sorted-range indexes, without re-sorting them; the bitmaps are rebuilt on next use
+        data = self.index.data
+        positions = np.sort(np.concatenate(list(appended.values()))) if appended else np.empty(0, dtype=np.intp)
+        with self._lock, self._values_lock:
+            for column, values in list(self.values.items()):
+                new_values = _float_values(data[column].iloc[len(values):])
+                if new_values.dtype == values.dtype:
+                    self.values[column] = np.concatenate([values, new_values])
+                else:
+                    # The column was widened to hold the new values, so its values are read again
+                    # and its sorted-range index is rebuilt on next use
+                    self.values[column] = _float_values(data[column])
+                    self.sorted.pop(column, None)
+                    self._building.discard(column)
+            for column, (order, values) in list(self.sorted.items()):
+                new_values = self.values[column][positions]
+                present = ~np.isnan(new_values)
+                new_order = np.argsort(new_values[present], kind="stable")
+                new_positions = positions[present][new_order].astype(_position_dtype(len(data)))
+                new_values = new_values[present][new_order]
+                at = np.searchsorted(values, new_values, side="right")
+                self.sorted[column] = (np.insert(order.astype(new_positions.dtype), at, new_positions), np.insert(values, at, new_values))
+            self.length = len(data)
+        self.value_bitmaps.clear()
+        self.bitmaps.clear()
+        self.cache.clear()
+
+    def reset(self):
+        # Drop the column values and sorted-range indexes; they are read in and built again on next use
+        with self._lock, self._values_lock:
+            self.values = {}
+            self.sorted = {}
+            self._building.clear()
+            self.length = len(self.index.data)
+        self.value_bitmaps.clear()
+        self.bitmaps.clear()
+        self.cache.clear()
+
+    def stats(self):
+        return {"indexed_columns": sorted(self.sorted), "scans": self.scans, **self.cache.stats()}
+
+
+# Values as floats with NaN for missing ones; float32 when that holds every value exactly
+def _float_values(series):
+    dtype = series.dtype
+    exact = dtype == np.float32 or (pd.api.types.is_integer_dtype(dtype) and dtype.itemsize <= 2)
+    return series.to_numpy(dtype=np.float32 if exact else np.float64, na_value=np.nan)
+
+
+# Row positions are stored as 32-bit integers when the table allows, halving the size of the sorted indexes
+def _position_dtype(rows):
+    return np.int32 if rows < 2 ** 31 else np.intp
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Environment variables that pick the dataset and where its columnar cache lives
+DATA_PATH_ENV = "PENGUINS_DATA"
+CACHE_DIR_ENV = "PENGUINS_CACHE_DIR"
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".dataset_cache")
+
+# Bumped when the cached layout or dtypes change, so caches written by older code are rebuilt
+CACHE_FORMAT = 2
+
+logger = logging.getLogger("penguins.data")
+
+
+# Where the penguins data comes from.
+# A source is the bundled Palmer Penguins data (path=None) or a CSV, Parquet or Feather file.
+# On first load the data is written to a columnar cache of .npy files, one per column,
+# with the dtypes compacted first (see compact_dtypes). Later loads, from any worker process,
+# memory-map those files read-only, so workers share one copy through the OS page cache
+# and start without parsing the source again.
+class DatasetSource:
+
+    def __init__(self, path=None, cache_dir=DEFAULT_CACHE_DIR):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.loaded_size = None  # Size of the source file when it was last loaded
+
+    @classmethod
+    def from_environment(cls):
+        return cls(os.environ.get(DATA_PATH_ENV) or None, os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR))
+
+    @property
+    def name(self):
+        return os.path.basename(self.path) if self.path else "palmerpenguins"
+
+    @property
+    def origin(self):
+        # The same for every version of the source, unlike cache_key
+        return os.path.abspath(self.path) if self.path else "palmerpenguins"
+
+    def read(self):
+        # Parse the original source without touching the cache
+        if self.path is None:
+            from palmerpenguins import load_penguins
+            return load_penguins()
+        extension = os.path.splitext(self.path)[1].lower()
+        if extension == ".csv":
+            return pd.read_csv(self.path)
+        if extension in (".parquet", ".pq"):
+            return pd.read_parquet(self.path)  # Needs pyarrow
+        if extension in (".feather", ".arrow"):
+            return pd.read_feather(self.path)  # Needs pyarrow
+        raise ValueError(f"Unsupported dataset file type: {self.path}")
+
+    def load(self, column_choices=None):
+        if self.path is not None:
+            self.loaded_size = os.path.getsize(self.path)
+        if self.cache_dir is None:
+            data = self.read_compact()
+        else:
+            cache_path = os.path.join(self.cache_dir, self.cache_key())
+            if not os.path.exists(os.path.join(cache_path, "schema.json")):
+                write_columnar_cache(self.read_compact(), cache_path, origin=self.origin)
+                self.remove_stale_caches(cache_path)
+            data = read_columnar_cache(cache_path)
+        if column_choices is not None:
+            validate_schema(data, column_choices)
+        return data
+
+    def read_compact(self):
+        original = self.read()
+        data = compact_dtypes(original)
+        logger.info(json.dumps({"event": "compact_dtypes", "source": self.name, **memory_report(original, data)}))
+        return data
+
+    # Delete the caches of earlier versions of this source once the current one is in place.
+    # Other sources can share the name, so a cache is only deleted when its schema records this origin.
+    # Workers still reading a deleted cache keep their memory-mapped columns.
+    def remove_stale_caches(self, current_path):
+        for entry in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, entry)
+            if not entry.startswith(f"{self.name}-") or entry == os.path.basename(current_path):
+                continue
+            try:
+                with open(os.path.join(path, "schema.json")) as schema_file:
+                    origin = json.load(schema_file).get("origin")
+            except (OSError, ValueError):
+                continue
+            if origin == self.origin:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def cache_key(self):
+        # Changes whenever the source file changes, so a stale cache is never read
+        if self.path is None:
+            from palmerpenguins import __version__ as version
+            fingerprint = f"palmerpenguins-{version}:{CACHE_FORMAT}"
+        else:
+            stat = os.stat(self.path)
+            fingerprint = f"{os.path.abspath(self.path)}:{stat.st_size}:{stat.st_mtime_ns}:{CACHE_FORMAT}"
+        return f"{self.name}-{hashlib.sha1(fingerprint.encode()).hexdigest()[:12]}"
+
+
+# The dataset must have species plus every column offered in the column dropdowns, all numeric
+def validate_schema(data, column_choices):
+    missing = [column for column in ["species", *column_choices.values()] if column not in data.columns]
+    if missing:
+        raise ValueError(f"Dataset is missing columns: {', '.join(missing)}")
+    not_numeric = [column for column in column_choices.values() if not pd.api.types.is_numeric_dtype(data[column])]
+    if not_numeric:
+        raise ValueError(f"Dataset columns must be numeric: {', '.join(not_numeric)}")
+
+
+# Smallest dtypes that still hold the data: strings become categoricals, whole-number columns the smallest
+# integer type that fits (nullable when they have missing values), and other measurements float32
+# when each value survives the round trip at its written precision (39.1 stays 39.1).
+def compact_dtypes(data):
+    columns = {}
+    for name, series in data.items():
+        if isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(series):
+            columns[name] = series
+        elif not pd.api.types.is_numeric_dtype(series):
+            columns[name] = series.astype("category")
+        else:
+            values = series.to_numpy(dtype=float, na_value=np.nan)
+            missing = np.isnan(values)
+            present = values[~missing]
+            if _whole(present):
+                dtype = _smallest_int(present)
+                columns[name] = series.astype(pd.api.types.pandas_dtype(dtype.name.capitalize()) if missing.any() else dtype)
+            elif np.array_equal(present.astype(np.float32).astype(str).astype(float), present):
+                columns[name] = series.astype(np.float32)
+            else:
+                columns[name] = series
+    return pd.DataFrame(columns, index=data.index)
+
+
+# A dtype holding both a compacted column's values and new ones compacted the same way (see compact_dtypes),
+# so appended rows widen a column rather than lose precision or overflow: int16 and int32 give int32,
+# float32 and float64 give float64, and integers stay nullable when either side has missing values.
+def common_dtype(dtype, other):
+    if dtype == other:
+        return dtype
+    numeric = [getattr(each, "numpy_dtype", each) for each in (dtype, other)]  # Nullable dtypes by their values' dtype
+    if not all(isinstance(each, np.dtype) and each.kind in "biuf" for each in numeric):
+        raise TypeError(f"Can't append {other} values to a {dtype} column")
+    common = np.promote_types(*numeric)
+    if common.kind in "iu" and (dtype != numeric[0] or other != numeric[1]):
+        return pd.api.types.pandas_dtype(common.name.capitalize())
+    return common
+
+
+# Whole numbers that fit in an int64; infinities and larger values stay floats
+def _whole(values):
+    if not np.isfinite(values).all() or not np.array_equal(values, np.round(values)):
+        return False
+    return not len(values) or (-2.0 ** 63 <= values.min() and values.max() < 2.0 ** 63)
+
+
+def _smallest_int(values):
+    low, high = (values.min(), values.max()) if len(values) else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+# Memory per column before and after compaction, in bytes
+def memory_report(before, after):
+    before_bytes = before.memory_usage(index=False, deep=True)
+    after_bytes = after.memory_usage(index=False, deep=True)
+    return {
+        "rows": len(after),
+        "bytes_before": int(before_bytes.sum()),
+        "bytes_after": int(after_bytes.sum()),
+        "columns": {
+            name: {
+                "dtype_before": str(before[name].dtype), "dtype_after": str(after[name].dtype),
+                "bytes_before": int(before_bytes[name]), "bytes_after": int(after_bytes[name]),
+            }
+            for name in after.columns
+        },
+    }
+
+
+def write_columnar_cache(data, cache_path, origin=None):
+    # Written to a temporary directory and renamed into place, so concurrent workers never see half a cache
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=os.path.dirname(cache_path))
+    schema = []
+    for position, column in enumerate(data.columns):
+        series = data[column]
+        file_name = f"{position}.npy"
+        if pd.api.types.is_extension_array_dtype(series) and pd.api.types.is_integer_dtype(series):
+            # Nullable integers keep their type: values with a separate missing-value mask
+            np.save(os.path.join(staging, file_name), series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0))
+            np.save(os.path.join(staging, f"{position}.mask.npy"), series.isna().to_numpy())
+            schema.append({"name": column, "kind": "nullable", "file": file_name, "mask": f"{position}.mask.npy"})
+        elif pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+            if series.hasnans and not isinstance(series.dtype, np.dtype):
+                values = series.to_numpy(dtype=float, na_value=np.nan)  # Other nullable types
+            else:
+                values = series.to_numpy()
+            np.save(os.path.join(staging, file_name), values)
+            schema.append({"name": column, "kind": "numeric", "file": file_name})
+        else:
+            categorical = series.astype("category")
+            np.save(os.path.join(staging, file_name), categorical.cat.codes.to_numpy())
+            schema.append({
+                "name": column, "kind": "categorical", "file": file_name,
+                "categories": [str(category) for category in categorical.cat.categories],
+            })
+    with open(os.path.join(staging, "schema.json"), "w") as schema_file:
+        json.dump({"columns": schema, "rows": len(data), "origin": origin}, schema_file)
+    try:
+        os.rename(staging, cache_path)
+    except OSError:
+        # Another worker finished first; its cache is identical
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def read_columnar_cache(cache_path):
+    with open(os.path.join(cache_path, "schema.json")) as schema_file:
+        schema = json.load(schema_file)
+    columns = {}
+    for column in schema["columns"]:
+        values = np.load(os.path.join(cache_path, column["file"]), mmap_mode="r")
+        if column["kind"] == "categorical":
+            values = pd.Categorical.from_codes(values, column["categories"])
+        elif column["kind"] == "nullable":
+            values = pd.arrays.IntegerArray(values, np.load(os.path.join(cache_path, column["mask"]), mmap_mode="r"))
+        # Wrapping each column in a Series keeps pandas from consolidating (copying) the memory maps
+        columns[column["name"]] = pd.Series(values, copy=False)
+    return pd.DataFrame(columns, copy=False)
+
+
+# Print how much memory compaction saves for a dataset: python dataset_source.py [path]
+if __name__ == "__main__":
+    import sys
+    source = DatasetSource(sys.argv[1] if len(sys.argv) > 1 else None, cache_dir=None)
+    original = source.read()
+    report = memory_report(original, compact_dtypes(original))
+    print(f"{source.name}: {report['rows']} rows, {report['bytes_before']:,} -> {report['bytes_after']:,} bytes")
+    for name, column in report["columns"].items():
+        print(f"  {name:<20} {column['dtype_before']:>10} -> {column['dtype_after']:<10} "
+              f"{column['bytes_before']:>12,} -> {column['bytes_after']:,}")
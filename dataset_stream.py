@@ -0,0 +1,100 @@
+import io
+import logging
+import os
+import threading
+
+import pandas as pd
+
+from dataset_source import validate_schema
+
+logger = logging.getLogger("penguins.stream")
+
+# Seconds between checks of the dataset file for appended rows
+STREAM_INTERVAL_ENV = "PENGUINS_STREAM_INTERVAL"
+
+
+# Rows appended to the loaded dataset while the app runs.
+# A CSV source is followed like a log: complete lines added to the end of the file are parsed
+# and appended. Other producers can call append() with a DataFrame of new rows.
+# Appended rows are merged into the species index and the shared engines incrementally,
+# and the version changes with every batch so figure caches and sessions can tell.
+# Listeners are called after every batch, from the thread that appended it.
+class DatasetStream:
+
+    def __init__(self, source, index, engines=(), caches=(), column_choices=None):
+        self.source = source
+        self.index = index
+        self.engines = engines  # Objects with extend(appended), updated in place, and reset() to rebuild from the index
+        self.caches = caches  # Objects with clear(), emptied on every append
+        self.column_choices = column_choices
+        self.base_version = source.cache_key()
+        self.batches = 0
+        self.rows_appended = 0
+        self.listeners = []  # Functions of no arguments
+        self._lock = threading.Lock()
+        self._follow_lock = threading.Lock()  # Held while the CSV is read and its new rows appended
+
+        # Only CSV files are followed; they are read from where the initial load stopped
+        self.follow = source.path is not None and source.path.lower().endswith(".csv")
+        if self.follow:
+            self.offset = source.loaded_size
+            self.columns = list(pd.read_csv(source.path, nrows=0).columns)
+
+    @property
+    def version(self):
+        return self.base_version if not self.batches else f"{self.base_version}+{self.batches}"
+
+    # Append any complete lines added to the CSV since the last read; returns the version.
+    # Only stats the file when it hasn't grown, so it is cheap enough to poll.
+    def update(self):
+        if self.follow:
+            with self._follow_lock:
+                rows, offset = self._read_appended()
+                if rows is not None and len(rows):
+                    # The offset moves past the rows once they are in the index, so a batch the index
+                    # rejects is read again and one it holds is never appended twice
+                    self.append(rows, offset=offset)
+                else:
+                    self.offset = offset
+        return self.version
+
+    def _read_appended(self):
+        size = os.path.getsize(self.source.path)
+        if size == self.offset:
+            return None, size
+        if size < self.offset:
+            logger.warning("%s shrank; restart the app to reload it", self.source.path)
+            return None, size
+        with open(self.source.path, "rb") as data_file:
+            data_file.seek(self.offset)
+            chunk = data_file.read(size - self.offset)
+        # A partly written last line is left for the next read
+        complete = chunk.rfind(b"\n") + 1
+        offset = self.offset + complete
+        if not chunk[:complete].strip():
+            return None, offset
+        return pd.read_csv(io.BytesIO(chunk[:complete]), header=None, names=self.columns), offset
+
+    def append(self, rows, offset=None):
+        if self.column_choices is not None:
+            validate_schema(rows, self.column_choices)
+        with self._lock:
+            appended = self.index.append(rows)
+            if offset is not None:
+                self.offset = offset
+            for engine in self.engines:
+                try:
+                    engine.extend(appended)
+                except Exception:
+                    # The rows are in the index either way, so an engine that can't merge them starts over from it
+                    logger.exception("Failed to merge appended rows into %s; rebuilding it", type(engine).__name__)
+                    engine.reset()
+            # Emptied last, so nothing read from the engines before they were extended is left behind
+            for cache in self.caches:
+                cache.clear()
+            self.batches += 1
+            self.rows_appended += len(rows)
+        logger.info("Appended %d rows, dataset version %s", len(rows), self.version)
+        for listener in self.listeners:
+            listener()
+        return appended
@@ -0,0 +1,67 @@
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+
+from filter_cache import LRUCache
+from instrumentation import note
+from widget_payload import note_payload_sizes
+
+# Memory budget for cached Plotly JSON, and the same again for cached PNGs
+FIGURE_CACHE_MB_ENV = "PENGUINS_FIGURE_CACHE_MB"
+
+
+# Process-wide cache of rendered figure payloads shared by every session.
+# Keys are the full tuple of inputs that shape a figure plus the dataset version,
+# so sessions with the same selections (most of them, on the defaults) reuse one render.
+# Plotly figures are cached as compacted JSON (see widget_payload.compact_figure), matplotlib figures as PNG files
+# for render.image; both are bounded by size, and evicted PNG files are deleted.
+# The size of each Plotly JSON served, cached or not, is noted as the render's payload_bytes,
+# along with its size before and after compacting.
+class FigureCache:
+
+    def __init__(self, max_bytes=None, directory=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(FIGURE_CACHE_MB_ENV, 64)) * 2 ** 20)
+        if directory is None:
+            # A private directory per process, removed when the process exits
+            directory = tempfile.mkdtemp(prefix="penguins-figures-")
+            atexit.register(shutil.rmtree, directory, True)
+        self.directory = directory
+        # key -> (figure JSON, its size before compacting)
+        self.plotly = LRUCache(max_entries=4096, max_bytes=max_bytes, sizeof=lambda entry: len(entry[0]))
+        self.png = LRUCache(max_entries=4096, max_bytes=max_bytes, sizeof=os.path.getsize, on_evict=_remove_file)
+
+    # Renders run off the event loop, so build_compacted and render_png return awaitables,
+    # build_compacted of compact_figure's result
+    async def plotly_json_async(self, key, build_compacted):
+        return _noted(await self.plotly.get_or_compute_async(key, build_compacted))
+
+    async def png_file_async(self, key, render_png):
+        async def write_png():
+            return self._write_png(key, await render_png())
+        return await self.png.get_or_compute_async(key, write_png)
+
+    def _write_png(self, key, png):
+        path = os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + ".png")
+        with open(path, "wb") as png_file:
+            png_file.write(png)
+        return path
+
+    def stats(self):
+        return {"plotly": self.plotly.stats(), "png": self.png.stats()}
+
+
+def _noted(entry):
+    figure_json, uncompacted_bytes = entry
+    note("payload_bytes", len(figure_json))
+    note_payload_sizes(figure_json, uncompacted_bytes)
+    return figure_json
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
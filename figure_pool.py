@@ -0,0 +1,133 @@
+import io
+import threading
+from contextlib import contextmanager
+
+from startup_timing import lazy_import
+
+# Idle figures kept per process; a render that finds none idle creates one
+POOL_SIZE = 4
+
+
+# A preallocated Agg figure and axes for histogram PNGs, redrawn in place from one render to the next.
+# The bars and KDE line of each series are kept: when the series and bin counts match the previous render,
+# only the bar positions and heights and the line data change; otherwise the artists are replaced.
+# Not thread-safe on its own; renders check one out of a FigurePool.
+class HistogramFigure:
+
+    def __init__(self):
+        Figure = lazy_import("matplotlib.figure").Figure
+        FigureCanvasAgg = lazy_import("matplotlib.backends.backend_agg").FigureCanvasAgg
+        self.figure = Figure()
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        self.warning = self.ax.text(
+            0.5, 0.5, "", horizontalalignment='center', verticalalignment='center',
+            transform=self.ax.transAxes, fontsize=12, color='purple',
+        )
+        self.artists = []  # (bars, line) per series
+        self.layout = None  # (name, bin count) per series, as last drawn
+        self.redraws = 0  # Renders that had to replace the artists
+
+    # Draw series of bars, each a dict with name, edges, heights, color, alpha and an optional (x, y) curve,
+    # at the output's size in CSS pixels, and return the PNG bytes.
+    # The legend is shown when there are several series, unless legend says otherwise.
+    def png(self, series, title="", xlabel="", ylabel="", warning=None, legend_title=None, legend=None, width=500, height=400, pixelratio=1):
+        dpi = 96 * pixelratio
+        if self.figure.get_dpi() != dpi:
+            self.figure.set_dpi(dpi)
+        self.figure.set_size_inches(width / 96, height / 96)
+
+        layout = [(item["name"], len(item["heights"])) for item in series]
+        if layout != self.layout:
+            self._replace_artists(series)
+            self.layout = layout
+        for item, (bars, line) in zip(series, self.artists):
+            edges = item["edges"]
+            for rect, left, right, height in zip(bars.patches, edges[:-1], edges[1:], item["heights"]):
+                rect.set_x(left)
+                rect.set_width(right - left)
+                rect.set_height(height)
+                rect.set_facecolor(item["color"])
+                rect.set_alpha(item["alpha"])
+            curve = item.get("curve")
+            line.set_visible(curve is not None)
+            if curve is not None:
+                line.set_data(*curve)
+                line.set_color(item["color"])
+
+        ax = self.ax
+        ax.relim(visible_only=True)
+        ax.autoscale_view()
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        self.warning.set_text(warning or "")
+        if (len(series) > 1 if legend is None else legend) and series:
+            ax.legend(title=legend_title)
+        elif ax.get_legend() is not None:
+            ax.get_legend().remove()
+        self.figure.tight_layout()
+
+        buffer = io.BytesIO()
+        self.canvas.print_png(buffer)
+        return buffer.getvalue()
+
+    def _replace_artists(self, series):
+        self.redraws += 1
+        for bars, line in self.artists:
+            bars.remove()
+            line.remove()
+        self.artists = []
+        for item in series:
+            edges = item["edges"]
+            bars = self.ax.bar(
+                edges[:-1], item["heights"], width=edges[1:] - edges[:-1], align="edge",
+                edgecolor="white", linewidth=0.5, label=item["name"],
+            )
+            line, = self.ax.plot([], [])
+            self.artists.append((bars, line))
+
+
+# Figures shared by the renders of one process (the app, or each render worker).
+# A render checks a figure out for its own use and returns it afterwards, so figures are reused
+# rather than created and torn down, and concurrent renders never draw on the same one.
+class FigurePool:
+
+    def __init__(self, factory=HistogramFigure, size=POOL_SIZE):
+        self.factory = factory
+        self.size = size
+        self.created = 0
+        self.reused = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    # Create figures ahead of the first renders
+    def preallocate(self, count=1):
+        figures = [self.factory() for _ in range(count)]
+        with self._lock:
+            self.created += len(figures)
+            self._idle.extend(figures[:self.size - len(self._idle)])
+
+    @contextmanager
+    def checkout(self):
+        with self._lock:
+            figure = self._idle.pop() if self._idle else None
+            if figure is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if figure is None:
+            figure = self.factory()
+        try:
+            yield figure
+        finally:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(figure)
+
+    def stats(self):
+        with self._lock:
+            return {"idle": len(self._idle), "created": self.created, "reused": self.reused}
+
+
+histogram_figures = FigurePool()
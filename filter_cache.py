@@ -0,0 +1,206 @@
+from collections import OrderedDict
+import asyncio
+import threading
+
+# Result of a computation that raised, for the callers that were waiting on it
+_FAILED = object()
+
+
+# Thread-safe LRU cache of computed values with hit/miss counters.
+# Values are shared between callers, so they must be treated as read-only.
+# With max_bytes set, the cache is also bounded by the total of sizeof(value),
+# and values larger than a quarter of that budget are returned without being cached.
+# Each key is computed by one caller at a time: others asking for it meanwhile wait for that result
+# rather than computing it again.
+class LRUCache:
+
+    def __init__(self, max_entries=16, max_bytes=None, sizeof=len, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict  # Called with each evicted value
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight of the thread computing it
+        self._async_flights = {}  # key -> future of the coroutine computing it
+
+    def get_or_compute(self, key, compute):
+        while True:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                    break
+            flight.done.wait()
+            if flight.value is not _FAILED:
+                return self._shared(flight.value)
+            # The computation raised; try it here
+        try:
+            # Compute outside the lock so a slow computation doesn't block cache hits
+            flight.value = self._store(key, compute())
+            return flight.value
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    # Same as get_or_compute, for a compute function that returns an awaitable.
+    # Callers share one computation per key on the event loop.
+    async def get_or_compute_async(self, key, compute):
+        while True:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            flight = self._async_flights.get(key)
+            if flight is None:
+                break
+            value = await asyncio.shield(flight)
+            if value is not _FAILED:
+                return self._shared(value)
+        flight = self._async_flights[key] = asyncio.get_running_loop().create_future()
+        value = _FAILED
+        try:
+            value = self._store(key, await compute())
+            return value
+        finally:
+            del self._async_flights[key]
+            flight.set_result(value)
+
+    def _shared(self, value):
+        # A value another caller computed counts as a hit
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)  # Mark as most recently used
+                self.hits += 1
+                return True, self._entries[key]
+        return False, None
+
+    def _store(self, key, value):
+        evicted = []
+        with self._lock:
+            self.misses += 1
+            size = self.sizeof(value) if self.max_bytes is not None else 0
+            if self.max_bytes is not None and size > self.max_bytes // 4:
+                return value
+            if key in self._entries:
+                # Stored again, e.g. by refresh racing a computation. A file cache stores the same path again,
+                # so the value is only evicted when it differs, or its file would be deleted from under the new entry.
+                replaced = self._pop(key)
+                if not _same_value(replaced, value):
+                    evicted.append(replaced)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            # Evict the least recently used entries
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                evicted.append(self._pop(next(iter(self._entries))))
+                self.evictions += 1
+        if self.on_evict is not None:
+            for evicted_value in evicted:
+                self.on_evict(evicted_value)
+        return value
+
+    def _pop(self, key):
+        self.bytes -= self._sizes.pop(key)
+        return self._entries.pop(key)
+
+    # Replace each cached value with update(key, value), or drop it when update returns None.
+    # Lets cached aggregates be brought up to date incrementally instead of recomputed.
+    # With rekey, the values kept move to rekey(key), e.g. a key ending in the rows they cover;
+    # a value stored under the new key in the meantime is kept instead.
+    def refresh(self, update, rekey=None):
+        with self._lock:
+            entries = list(self._entries.items())
+        # Update outside the lock, like compute in get_or_compute
+        updated = [(key, value, update(key, value)) for key, value in entries]
+
+        evicted = []
+        with self._lock:
+            for key, value, new_value in updated:
+                new_key = key if rekey is None else rekey(key)
+                if (new_value is value and new_key == key) or self._entries.get(key) is not value:
+                    continue  # Unchanged, or replaced or evicted in the meantime
+                self._pop(key)
+                if new_value is not value:
+                    evicted.append(value)
+                if new_value is None:
+                    continue
+                if new_key in self._entries:
+                    evicted.append(new_value)
+                    continue
+                size = self.sizeof(new_value) if self.max_bytes is not None else 0
+                self._entries[new_key] = new_value
+                self._sizes[new_key] = size
+                self.bytes += size
+        if self.on_evict is not None:
+            for evicted_value in evicted:
+                self.on_evict(evicted_value)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries), "bytes": self.bytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            evicted = list(self._entries.values())
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+        if self.on_evict is not None:
+            for evicted_value in evicted:
+                self.on_evict(evicted_value)
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = _FAILED
+
+
+def _same_value(old, new):
+    if old is new:
+        return True
+    try:
+        return bool(old == new)
+    except (TypeError, ValueError):  # e.g. arrays, which compare elementwise
+        return False
+
+
+# Process-wide cache of species-filtered views from a SpeciesIndex.
+# One instance is shared by every session, so each distinct species selection
+# is filtered once per process and reused by all outputs that ask for it.
+# Views are keyed by the rows they cover, read before they are taken, so a view taken while rows
+# are appended is never returned once they are.
+class SpeciesFilterCache(LRUCache):
+
+    def __init__(self, index, max_entries=16):
+        super().__init__(max_entries)
+        self.index = index
+
+    @property
+    def data(self):
+        return self.index.data
+
+    # The view of the first `length` rows, all the rows the index covers by default
+    def get(self, selected_species, length=None):
+        key = (frozenset(selected_species), self.index.length if length is None else length)
+        return self.get_or_compute(key, lambda: self.index.take(*key))
@@ -0,0 +1,231 @@
+import numpy as np
+
+from column_stats import value_range
+from figure_pool import histogram_figures
+from filter_cache import LRUCache
+from startup_timing import lazy_import
+
+# Above this many values the KDE switches from exact evaluation to the binned FFT approximation
+FFT_KDE_THRESHOLD = 10_000
+
+
+# Per-species histogram counts on shared bin edges
+class Histogram:
+
+    def __init__(self, column, edges, counts, value_range=None, length=None):
+        self.column = column
+        self.edges = edges
+        self.counts = counts  # series name -> counts per bin
+        self.value_range = value_range  # (min, max) of the counted values, None when there were none
+        self.length = length  # Rows of the index counted, when counted from a StatsIndex
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    @property
+    def widths(self):
+        return np.diff(self.edges)
+
+
+# Vectorized NumPy histogram engine shared by every session.
+# Values, ranges and counts come from a StatsIndex: edges from the selected species' range
+# and counts by binary search on their sorted values, without rescanning the data.
+# Counts are computed once per (column, species set, bin count, overlay mode)
+# and rendered as pre-aggregated bars, so what is drawn or sent to the browser
+# scales with the bin count instead of the row count.
+# KDE curves don't depend on the bin count, so they are cached separately
+# per (column, species set, overlay mode) and reused when only the bins change.
+# Both are also keyed by the rows the statistics cover, so one computed while rows are appended
+# is never served once they are.
+class HistogramEngine:
+
+    def __init__(self, stats, max_entries=128):
+        self.stats = stats
+        self.index = stats.index
+        self.length = stats.length  # Rows the cached histograms were brought up to date with
+        self.cache = LRUCache(max_entries)
+        self.kde_cache = LRUCache(max_entries)
+
+    def values(self, column, selected_species, combined=False):
+        # Sorted non-null values per selected species, in category order
+        if combined:
+            return {"All": self.stats.combined(column, selected_species).values}
+        return {species: entry.values for species, entry in self.stats.per_species(column, selected_species).items()}
+
+    def histogram(self, column, selected_species, bins, combined=False):
+        key = (column, frozenset(selected_species), int(bins), bool(combined), self.stats.length)
+        return self.cache.get_or_compute(key, lambda: self._compute(*key[:-1]))
+
+    def _compute(self, column, selected_species, bins, combined):
+        length, entries = self.stats.covered(column, selected_species)
+
+        # Equal-width edges over the selected data range, like seaborn's bins=n
+        data_range = value_range(entries.values())
+        low, high = data_range or (0.0, 1.0)
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        edges = np.linspace(low, high, bins + 1)
+
+        counts = {species: entry.counts(edges) for species, entry in entries.items()}
+        if combined:
+            counts = {"All": sum(counts.values(), np.zeros(bins, dtype=np.int64))}
+        return Histogram(column, edges, counts, data_range, length)
+
+    # The histogram of the selected species counting only some of their values (a cross-filter selection,
+    # as series name -> values), on the edges and series of the unrestricted histogram so the two line up bar for bar
+    def restricted(self, column, selected_species, bins, values, combined=False):
+        hist = self.histogram(column, selected_species, bins, combined)
+        empty = np.empty(0)
+        counts = {name: np.histogram(values.get(name, empty), hist.edges)[0] for name in hist.counts}
+        return Histogram(column, hist.edges, counts, hist.value_range)
+
+    # KDE curves of the same values, per series like kde()
+    def restricted_kde(self, column, selected_species, values, combined=False, method="auto"):
+        names = ["All"] if combined else list(self.stats.per_species(column, selected_species))
+        return {name: kde_curve(values.get(name, np.empty(0)), method=method) for name in names}
+
+    def extend(self, appended):
+        # Bring the caches up to date with rows appended to the index (species -> new row positions).
+        # Histograms whose range the new values stay within add their counts on the same edges,
+        # which gives exactly what a recompute would.
+        # Histograms whose range grows and KDEs (whose bandwidth depends on every value) are dropped
+        # and recomputed on next use. Entries for species without new rows are left alone.
+        # Runs after the statistics are extended; what is kept moves to their new length.
+        previous, length = self.length, self.stats.length
+        new_values = {}
+
+        def added(column, species):
+            if (column, species) not in new_values:
+                column_values = self.index.data[column].iloc[appended[species]].to_numpy(dtype=float, na_value=np.nan)
+                new_values[column, species] = column_values[~np.isnan(column_values)]
+            return new_values[column, species]
+
+        def extend_histogram(key, hist):
+            column, selected_species, bins, combined, _ = key
+            if hist.length == length:
+                return hist  # Counted from the extended statistics already
+            if hist.length != previous:
+                return None
+            touched = [species for species in self.index.species if species in selected_species and species in appended]
+            added_values = {species: added(column, species) for species in touched}
+            all_added = np.concatenate(list(added_values.values()) or [np.empty(0)])
+            if not len(all_added):
+                return Histogram(column, hist.edges, hist.counts, hist.value_range, length)
+            if hist.value_range is None or hist.value_range[0] == hist.value_range[1]:
+                return None
+            if all_added.min() < hist.value_range[0] or all_added.max() > hist.value_range[1]:
+                return None
+            if combined:
+                counts = {"All": hist.counts["All"] + np.histogram(all_added, hist.edges)[0]}
+            elif all(species in hist.counts for species in touched):
+                counts = dict(hist.counts)
+                for species, species_added in added_values.items():
+                    counts[species] = counts[species] + np.histogram(species_added, hist.edges)[0]
+            else:
+                return None  # A species new to the selection changes the series
+            return Histogram(column, hist.edges, counts, hist.value_range, length)
+
+        def moved(key):
+            return key[:-1] + (length,)
+
+        self.cache.refresh(extend_histogram, rekey=moved)
+        self.kde_cache.refresh(lambda key, kde: None if key[-1] != previous or key[1] & appended.keys() else kde, rekey=moved)
+        self.length = length
+
+    def reset(self):
+        self.cache.clear()
+        self.kde_cache.clear()
+        self.length = self.stats.length
+
+    def kde(self, column, selected_species, combined=False, method="auto"):
+        # series name -> (grid, count density), or None when a series has too little spread
+        key = (column, frozenset(selected_species), bool(combined), method, self.stats.length)
+        return self.kde_cache.get_or_compute(key, lambda: {
+            name: kde_curve(series_values, method=method)
+            for name, series_values in self.values(column, selected_species, combined).items()
+        })
+
+
+# Gaussian KDE with Scott's bandwidth, evaluated over the data range like histplot(kde=True).
+# The density is scaled by the number of values, so multiplying by a bin width gives counts per bin.
+# method is "exact", "fft" or "auto". "fft" bins the values onto a regular mesh and convolves
+# with the kernel by FFT, which costs O(N + mesh log mesh) instead of O(N x grid).
+def kde_curve(values, gridsize=200, method="auto"):
+    if len(values) < 2 or values.std(ddof=1) == 0:
+        return None
+    bandwidth = values.std(ddof=1) * len(values) ** (-1 / 5)
+    grid = np.linspace(values.min(), values.max(), gridsize)
+    if method == "fft" or (method == "auto" and len(values) > FFT_KDE_THRESHOLD):
+        density = binned_kde(values, bandwidth, grid)
+    else:
+        z = (grid[:, None] - values[None, :]) / bandwidth
+        density = np.exp(-0.5 * z ** 2).sum(axis=1) / (len(values) * bandwidth * np.sqrt(2 * np.pi))
+    return grid, density * len(values)
+
+
+# Approximate Gaussian KDE: linear binning onto a mesh, then an FFT convolution with the kernel
+def binned_kde(values, bandwidth, grid, mesh_size=1024):
+    low, high = grid[0] - 4 * bandwidth, grid[-1] + 4 * bandwidth
+    mesh = np.linspace(low, high, mesh_size)
+    delta = mesh[1] - mesh[0]
+
+    # Split each value's weight between its two nearest mesh points
+    position = (values - low) / delta
+    left = np.floor(position).astype(np.intp)
+    fraction = position - left
+    weights = np.bincount(left, 1 - fraction, minlength=mesh_size)
+    weights += np.bincount(np.minimum(left + 1, mesh_size - 1), fraction, minlength=mesh_size)
+
+    # Kernel sampled on the mesh spacing, truncated at 4 bandwidths
+    half_width = min(mesh_size - 1, int(np.ceil(4 * bandwidth / delta)))
+    offsets = np.arange(-half_width, half_width + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+
+    size = 1 << int(np.ceil(np.log2(mesh_size + len(kernel))))
+    convolved = np.fft.irfft(np.fft.rfft(weights, size) * np.fft.rfft(kernel, size), size)
+    density = convolved[half_width:half_width + mesh_size] / len(values)
+    return np.interp(grid, mesh, density)
+
+
+# Bars and KDE lines (scaled to counts) of a Histogram, as series for a pooled HistogramFigure
+def histogram_series(hist, colors, kde=None, default_color="#1f77b4"):
+    layered = len(hist.counts) > 1
+    series = []
+    for name, counts in hist.counts.items():
+        curve = kde.get(name) if kde else None
+        if curve is not None:
+            grid, density = curve
+            curve = (grid, density * hist.widths[0])
+        series.append({
+            "name": name, "edges": hist.edges, "heights": counts, "color": colors.get(name, default_color),
+            "alpha": 0.5 if layered else 0.75, "curve": curve,
+        })
+    return series
+
+
+# Render a Histogram to PNG bytes without pyplot, at the output's size in CSS pixels,
+# on a figure checked out of this process's pool
+def histogram_png(hist, colors, kde=None, title="", xlabel="", warning=None, width=500, height=400, pixelratio=1):
+    with histogram_figures.checkout() as figure:
+        return figure.png(
+            histogram_series(hist, colors, kde=kde), title=title, xlabel=xlabel, ylabel="Count", warning=warning,
+            legend_title="species", width=width, height=height, pixelratio=pixelratio,
+        )
+
+
+# Build Plotly bar traces from a Histogram, one trace per series
+def histogram_traces(hist, colors, barmode, default_color="#636EFA"):
+    go = lazy_import("plotly.graph_objects")
+    traces = []
+    for name, counts in hist.counts.items():
+        bar = dict(
+            x=hist.centers, y=counts, name=name,
+            marker_color=colors.get(name, default_color),
+            showlegend=len(hist.counts) > 1,
+        )
+        if barmode == "overlay":
+            # Each bar spans its whole bin, like px.histogram
+            bar["width"] = hist.widths
+        traces.append(go.Bar(**bar))
+    return traces
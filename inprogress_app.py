@@ -1,13 +1,21 @@
 from shiny import App, Inputs, Outputs, Session, ui, render
-import matplotlib.pyplot as plt
+import tempfile
+
+import numpy as np
 import plotly.express as px
 import pandas as pd  # Import pandas here
 from shinywidgets import output_widget, render_widget
 import shinyswatch
-import palmerpenguins  # This Package Provides the Palmer Penguin Dataset
+from dataset_source import DatasetSource
+from figure_pool import histogram_figures
+from column_stats import StatsIndex
+from species_index import SpeciesIndex
+from table_pager import display_rows
 
-# Load the Palmer Penguins dataset
-penguins = palmerpenguins.load_penguins()  # Correctly load the dataset
+# Load the Palmer Penguins dataset from the shared columnar cache and index its rows by species once at load time
+species_index = SpeciesIndex(DatasetSource.from_environment().load())
+penguins = species_index.data
+stats_index = StatsIndex(species_index, ["flipper_length_mm"])
 
 app_ui = ui.page_fluid(
     ui.tags.head(
@@ -124,24 +132,35 @@ app_ui = ui.page_fluid(
 def server(input, output, session):
 
     @output
-    @render.plot(alt="A histogram of flipper length from Palmer Penguins dataset")
+    @render.image(delete_file=True)
     def penguin_flipper_histogram():
-        plt.clf()
         selected_species = input.multi_choice_input()
-        filtered_data = penguins[penguins['species'].isin(selected_species)] if selected_species else penguins
+        bins = input.selected_number_of_bins() or 10  # plt.hist's default when the slider has no value
 
         colors = {"Adelie": "#0f4c5c", "Chinstrap": "#fb8b24", "Gentoo": "#5f0f40"}
+        series = []
         for species in selected_species:
-            species_data = filtered_data[filtered_data['species'] == species]['flipper_length_mm'].dropna()
-            plt.hist(species_data, bins=input.selected_number_of_bins(), 
-                     density=True, alpha=0.5, color=colors[species], 
-                     label=species)
-        
-        plt.xlabel("Flipper Length (mm)")
-        plt.ylabel("Density")
-        plt.title("Histogram of Flipper Length from Palmer Penguins Dataset")
-        plt.legend(title="Penguin Species")
-    
+            # Non-null values precomputed per species in the statistics index
+            species_data = stats_index.get('flipper_length_mm', species).values
+            density, edges = np.histogram(species_data, bins=bins, density=True)
+            series.append({"name": species, "edges": edges, "heights": density, "color": colors[species], "alpha": 0.5})
+
+        # Drawn on a pooled figure rather than pyplot's global one, at the output's size
+        width = session.clientdata.output_width("penguin_flipper_histogram") or 500
+        height = session.clientdata.output_height("penguin_flipper_histogram") or 400
+        with histogram_figures.checkout() as figure:
+            png = figure.png(
+                series, title="Histogram of Flipper Length from Palmer Penguins Dataset",
+                xlabel="Flipper Length (mm)", ylabel="Density", legend_title="Penguin Species", legend=True,
+                width=width, height=height, pixelratio=session.clientdata.pixelratio() or 1,
+            )
+        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as png_file:
+            png_file.write(png)
+        return {
+            "src": png_file.name, "width": f"{width}px", "height": f"{height}px",
+            "alt": "A histogram of flipper length from Palmer Penguins dataset",
+        }
+
     @output
     @render_widget  # Use render_widget for the Plotly histogram
     def penguin_histogram(): 
@@ -160,10 +179,10 @@ def server(input, output, session):
     @output
     @render.data_frame
     def penguins_df():
-        return render.DataGrid(penguins)
+        return render.DataGrid(display_rows(penguins))
 
     @output
     @render.data_frame  
     def penguins_dt():
-        return render.DataTable(penguins) 
+        return render.DataTable(display_rows(penguins)) 
 app = App(app_ui, server)
@@ -0,0 +1,92 @@
+import time
+
+from shiny import reactive
+
+
+# Coalesce a rapidly changing reactive expression so dependents only see its settled value.
+# debounce waits until the value has stopped changing for delay_secs; throttle passes at most
+# one new value per delay_secs while it keeps changing, plus the final one.
+# Both return a reactive calc that holds the initial value right away and must be used inside server()
+# so their effects belong to the session.
+def debounce(delay_secs):
+    def wrapper(fn):
+        deadline = reactive.value(None)
+        trigger = reactive.value(0)
+        initialized = False
+
+        @reactive.calc
+        def latest():
+            return fn()
+
+        # Every change after the initial value pushes the deadline back
+        @reactive.effect(priority=102)
+        def _():
+            nonlocal initialized
+            latest()
+            if initialized:
+                deadline.set(time.monotonic() + delay_secs)
+            initialized = True
+
+        @reactive.effect(priority=101)
+        def _():
+            when = deadline.get()
+            if when is None:
+                return
+            remaining = when - time.monotonic()
+            if remaining > 0:
+                reactive.invalidate_later(remaining)
+                return
+            with reactive.isolate():
+                deadline.set(None)
+                trigger.set(trigger.get() + 1)
+
+        @reactive.calc
+        @reactive.event(trigger, ignore_none=False)
+        def settled():
+            return latest()
+
+        return settled
+    return wrapper
+
+
+def throttle(delay_secs):
+    def wrapper(fn):
+        last_sent = reactive.value(float("-inf"))
+        pending = reactive.value(False)
+        trigger = reactive.value(0)
+        initialized = False
+
+        @reactive.calc
+        def latest():
+            return fn()
+
+        @reactive.effect(priority=102)
+        def _():
+            nonlocal initialized
+            latest()
+            if initialized:
+                pending.set(True)
+            initialized = True
+
+        # Pass the value on right away if the window has passed, otherwise when it does
+        @reactive.effect(priority=101)
+        def _():
+            if not pending.get():
+                return
+            with reactive.isolate():
+                remaining = last_sent.get() + delay_secs - time.monotonic()
+            if remaining > 0:
+                reactive.invalidate_later(remaining)
+                return
+            with reactive.isolate():
+                pending.set(False)
+                last_sent.set(time.monotonic())
+                trigger.set(trigger.get() + 1)
+
+        @reactive.calc
+        @reactive.event(trigger, ignore_none=False)
+        def throttled():
+            return latest()
+
+        return throttled
+    return wrapper
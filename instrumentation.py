@@ -0,0 +1,174 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+from shiny import reactive
+
+logger = logging.getLogger("penguins.metrics")
+
+# Seconds between structured metrics log lines; 0 turns the periodic log off
+METRICS_LOG_INTERVAL_ENV = "PENGUINS_METRICS_LOG_INTERVAL"
+
+# Samples kept per output for percentile aggregation
+MAX_SAMPLES = 1000
+
+_current_sample = contextvars.ContextVar("current_sample", default=None)
+
+
+# Process-wide render metrics, aggregated across sessions.
+# Each render of an instrumented output records its wall time, the time spent in each
+# named phase (e.g. "filter", "build"), and the size of the payload it returned.
+class RenderMetrics:
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.samples = defaultdict(lambda: deque(maxlen=max_samples))  # output -> recent samples
+        self.renders = defaultdict(int)
+        self.input_invalidations = defaultdict(int)
+        self.caches = {}  # name -> function returning the cache's counters
+        self._lock = threading.Lock()
+
+    def record(self, output_name, sample):
+        with self._lock:
+            self.samples[output_name].append(sample)
+            self.renders[output_name] += 1
+
+    def count_input(self, input_name):
+        with self._lock:
+            self.input_invalidations[input_name] += 1
+
+    def register_cache(self, name, stats):
+        self.caches[name] = stats
+
+    def summary(self):
+        with self._lock:
+            samples = {name: list(output_samples) for name, output_samples in self.samples.items()}
+            renders = dict(self.renders)
+            invalidations = dict(self.input_invalidations)
+        outputs = {}
+        for name, output_samples in samples.items():
+            fields = sorted({field for sample in output_samples for field in sample})
+            outputs[name] = {"renders": renders[name]}
+            for field in fields:
+                values = [sample[field] for sample in output_samples if sample.get(field) is not None]
+                if values:
+                    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+                    outputs[name][field] = {"p50": round(p50, 6), "p90": round(p90, 6), "p99": round(p99, 6), "max": round(max(values), 6)}
+        caches = {name: stats() for name, stats in self.caches.items()}
+        return {"outputs": outputs, "input_invalidations": invalidations, "caches": caches}
+
+    # Starlette endpoint serving the summary as JSON
+    async def endpoint(self, request):
+        from starlette.responses import JSONResponse
+        return JSONResponse(self.summary())
+
+    def start_periodic_log(self, interval=None):
+        interval = float(os.environ.get(METRICS_LOG_INTERVAL_ENV, 60) if interval is None else interval)
+        if interval <= 0:
+            return None
+
+        def log_forever():
+            while True:
+                time.sleep(interval)
+                if self.renders:
+                    logger.info(json.dumps({"event": "render_metrics", **self.summary()}))
+
+        thread = threading.Thread(target=log_forever, name="render-metrics-log", daemon=True)
+        thread.start()
+        return thread
+
+
+metrics = RenderMetrics()
+
+
+# Time a named phase of the render that is currently being instrumented
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample = _current_sample.get()
+        if sample is not None:
+            sample[f"{name}_s"] = sample.get(f"{name}_s", 0.0) + time.perf_counter() - start
+
+
+# Record a value (e.g. a size in bytes) on the render that is currently being instrumented
+def note(name, value):
+    sample = _current_sample.get()
+    if sample is not None:
+        sample[name] = value
+
+
+# Wrap a render function (below the render decorator) so each call is recorded under its name,
+# or under the given one, e.g. @instrumented(name="plot") on the task that renders the plot output
+def instrumented(fn=None, registry=metrics, name=None):
+    if fn is None:
+        return functools.partial(instrumented, registry=registry, name=name)
+    name = name or fn.__name__
+
+    def finish(sample, start, result):
+        sample["wall_s"] = time.perf_counter() - start
+        if "payload_bytes" not in sample:  # Noted by the render when it already has its payload serialized
+            with phase("serialize"):
+                sample["payload_bytes"] = payload_size(result)
+        registry.record(name, sample)
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            sample, start = {}, time.perf_counter()
+            token = _current_sample.set(sample)
+            try:
+                result = await fn(*args, **kwargs)
+                finish(sample, start, result)
+                return result
+            finally:
+                _current_sample.reset(token)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        sample, start = {}, time.perf_counter()
+        token = _current_sample.set(sample)
+        try:
+            result = fn(*args, **kwargs)
+            finish(sample, start, result)
+            return result
+        finally:
+            _current_sample.reset(token)
+    return wrapper
+
+
+# Count how often each input is set (its initial value included); every change invalidates the outputs that read it.
+# Must be called inside server() so the effects belong to the session.
+def count_input_invalidations(input, input_names, registry=metrics):
+    for input_name in input_names:
+        @reactive.effect
+        def _(input_name=input_name):
+            input[input_name]()
+            registry.count_input(input_name)
+
+
+# Approximate size of what a render function sends to the browser, in bytes.
+# Plotly figures aren't serialized again just to be measured: their renders note the size of the JSON they were built from.
+def payload_size(result):
+    if result is None:
+        return 0
+    if isinstance(result, (str, bytes)):
+        return len(result)
+    if isinstance(result, dict) and "src" in result:  # render.image
+        return os.path.getsize(result["src"])
+    if hasattr(result, "to_plotly_json"):
+        return None
+    data = getattr(result, "data", None)  # render.DataGrid / render.DataTable
+    if hasattr(data, "to_json"):
+        return len(data.to_json(orient="split"))
+    return None
@@ -0,0 +1,143 @@
+import math
+import os
+
+import numpy as np
+
+from filter_cache import LRUCache
+
+# "markers" draws a penguin icon marker per island over the island layer; "geojson" draws only the island layer,
+# so each session's map holds a single widget for the islands
+MAP_MODE_ENV = "PENGUINS_MAP_MODE"
+
+# Circle radius in pixels for an island with no selected penguins and for the most populous island
+MIN_RADIUS = 8
+MAX_RADIUS = 30
+
+
+# Row counts, and non-null counts and sums of each measurement, per island and species.
+# Every array is indexed [island, species] by the categories' positions.
+class IslandTotals:
+
+    def __init__(self, islands, species, rows, counts, sums):
+        self.islands = islands
+        self.species = species
+        self.rows = rows
+        self.counts = counts  # column -> array
+        self.sums = sums  # column -> array
+
+    # One vectorized pass: every row is binned by its island and species category codes
+    @classmethod
+    def from_rows(cls, rows, columns):
+        island = rows["island"].cat
+        species = rows["species"].cat
+        shape = (len(island.categories), len(species.categories))
+        island_codes = island.codes.to_numpy()
+        species_codes = species.codes.to_numpy()
+        labelled = (island_codes >= 0) & (species_codes >= 0)
+        cells = (island_codes.astype(np.int64) * shape[1] + species_codes)[labelled]
+
+        def binned(positions, weights=None):
+            return np.bincount(positions, weights, minlength=shape[0] * shape[1]).reshape(shape)
+
+        counts = {}
+        sums = {}
+        for column in columns:
+            values = rows[column].to_numpy(dtype=float, na_value=np.nan)[labelled]
+            measured = ~np.isnan(values)
+            counts[column] = binned(cells[measured])
+            sums[column] = binned(cells[measured], values[measured])
+        return cls(list(island.categories), list(species.categories), binned(cells), counts, sums)
+
+    def added(self, other):
+        return IslandTotals(
+            self.islands, self.species, self.rows + other.rows,
+            {column: counts + other.counts[column] for column, counts in self.counts.items()},
+            {column: sums + other.sums[column] for column, sums in self.sums.items()},
+        )
+
+
+# Penguin counts and mean measurements per island for the map's island layer, shared by every session.
+# The totals are computed once from the index and updated with appended rows (see extend);
+# the GeoJSON for each species selection is cached until they change, so a selection change costs
+# each session one layer data update and no recomputation.
+class IslandLayer:
+
+    def __init__(self, index, coordinates, colors, columns, max_entries=16):
+        self.index = index
+        self.coordinates = coordinates  # "<island> Island" -> (lat, lon)
+        self.colors = colors  # species -> color; an island takes the color of its most common selected species
+        self.columns = columns  # display name -> column, for the means
+        self.totals = IslandTotals.from_rows(index.data, columns.values())
+        self.cache = LRUCache(max_entries)  # species selection -> FeatureCollection
+
+    def extend(self, appended):
+        # Add the rows appended to the index (species -> new row positions) to the totals
+        if not appended:
+            return
+        data = self.index.data
+        new_totals = IslandTotals.from_rows(data.iloc[np.concatenate(list(appended.values()))], self.columns.values())
+        if new_totals.islands == self.totals.islands and new_totals.species == self.totals.species:
+            self.totals = self.totals.added(new_totals)
+        else:
+            self.totals = IslandTotals.from_rows(data, self.columns.values())  # A new island or species
+        self.cache.clear()
+
+    def reset(self):
+        self.totals = IslandTotals.from_rows(self.index.data, self.columns.values())
+        self.cache.clear()
+
+    # FeatureCollection with a circle per island for the selected species; shared, so treat it as read-only
+    def features(self, selected_species):
+        key = frozenset(selected_species)
+        return self.cache.get_or_compute(key, lambda: self._build(key))
+
+    def _build(self, selected_species):
+        totals = self.totals
+        selected = np.array([species in selected_species for species in totals.species], dtype=bool)
+        rows = totals.rows[:, selected]
+        penguins = rows.sum(axis=1)
+        largest = max(1, int(totals.rows.sum(axis=1).max())) if len(totals.islands) else 1  # Same scale for every selection
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = {
+                name: totals.sums[column][:, selected].sum(axis=1) / totals.counts[column][:, selected].sum(axis=1)
+                for name, column in self.columns.items()
+            }
+        selected_names = [species for species, chosen in zip(totals.species, selected) if chosen]
+
+        features = []
+        for position, island in enumerate(totals.islands):
+            location = self.coordinates.get(f"{island} Island")
+            if location is None:
+                continue
+            lat, lon = location
+            species_counts = {str(species): int(count) for species, count in zip(selected_names, rows[position]) if count}
+            total = int(penguins[position])
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},  # GeoJSON is (lon, lat)
+                "properties": {
+                    "island": str(island), "penguins": total, "species": species_counts,
+                    "means": {name: None if np.isnan(values[position]) else round(float(values[position]), 1) for name, values in means.items()},
+                    "style": {
+                        "radius": MIN_RADIUS + (MAX_RADIUS - MIN_RADIUS) * math.sqrt(total / largest),
+                        "color": "white", "weight": 2, "fillOpacity": 0.8 if total else 0.3,
+                        "fillColor": self.colors.get(max(species_counts, key=species_counts.get), "gray") if species_counts else "gray",
+                    },
+                },
+            })
+        return {"type": "FeatureCollection", "features": features}
+
+
+# HTML describing one island feature, for the map's hover panel
+def describe_island(properties):
+    lines = [f"<b>{properties['island']} Island</b>: {properties['penguins']} penguins"]
+    lines += [f"{species}: {count}" for species, count in properties["species"].items()]
+    lines += [f"Mean {name}: {value}" for name, value in properties["means"].items() if value is not None]
+    return "<br>".join(lines)
+
+
+def map_mode():
+    mode = os.environ.get(MAP_MODE_ENV, "markers")
+    if mode not in ("markers", "geojson"):
+        raise ValueError(f"Unknown map mode: {mode!r}")
+    return mode
@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import socket
+import time
+
+import numpy as np
+import websockets
+
+# Inputs a browser sends when the page loads; every output reports itself visible so it renders
+INITIAL_INPUTS = {
+    "n": 25, "selected_attribute": "Body Mass (g)", "multi_choice_input": ["Adelie", "Chinstrap", "Gentoo"], "show_all": False,
+    "x_column": "Body Mass (g)", "numeric": 20, "multi_choice_PlotlyH": ["Adelie", "Chinstrap", "Gentoo"],
+    "show_all_PlotlyH": False, "single_color": False,
+    "x_column_scatter": "Body Mass (g)", "y_column_scatter": "Flipper Length (mm)",
+    "species_input": ["Adelie", "Chinstrap", "Gentoo"], "scatter_mode": "auto",
+    "species_input_df_dt": ["Adelie", "Chinstrap", "Gentoo"], "table_sort_column": "", "table_descending": False,
+    "table_filter_column": "island", "table_filter_value": "", "table_page_size": "25", "table_page": 1,
+    "center": "Biscoe Island",
+    ".clientdata_output_plot_width": 500, ".clientdata_output_plot_height": 400, ".clientdata_pixelratio": 1,
+}
+OUTPUTS = [
+    "plot", "penguins_histogram", "penguins_scatter_plot", "map",
+    "table_page_info", "species_summary", "penguins_df", "penguins_dt",
+]
+for output_name in OUTPUTS:
+    INITIAL_INPUTS[f".clientdata_output_{output_name}_hidden"] = False
+
+SPECIES = ["Adelie", "Chinstrap", "Gentoo"]
+SPECIES_SELECTIONS = [list(chosen) for count in range(1, len(SPECIES) + 1) for chosen in itertools.combinations(SPECIES, count)]
+DISPLAY_NAMES = ["Flipper Length (mm)", "Body Mass (g)", "Bill Length (mm)", "Bill Depth (mm)"]
+
+# Seconds to wait for the outputs a step should update
+STEP_TIMEOUT = 30
+
+
+# One user's interactions, as (kind, input updates, outputs the updates should re-render, pause before the next step).
+# A slider drag is a burst of ticks; only the last one is timed, since the app coalesces the rest.
+# Every step leaves its input at a value other than the current one, or nothing would re-render and the step
+# would wait out STEP_TIMEOUT.
+def user_actions(rng):
+    current = dict(INITIAL_INPUTS)
+
+    def change(name, choices):
+        current[name] = rng.choice([value for value in choices if value != current[name]])
+        return current[name]
+
+    actions = []
+    for _ in range(3):
+        actions.append(("species toggle", [{"multi_choice_input": change("multi_choice_input", SPECIES_SELECTIONS)}], ["plot"], 1.0))
+        stop = change("n", range(8, 51))
+        ticks = [{"n": value} for value in range(stop - 7, stop + 1)]
+        actions.append(("slider drag", ticks, ["plot"], 1.0))
+        actions.append(("bins typed", [{"numeric": change("numeric", range(5, 61))}], ["penguins_histogram"], 1.0))
+        actions.append(("axis change", [{"x_column_scatter": change("x_column_scatter", DISPLAY_NAMES)}], ["penguins_scatter_plot"], 1.0))
+        actions.append((
+            "table species", [{"species_input_df_dt": change("species_input_df_dt", SPECIES_SELECTIONS)}],
+            ["penguins_df", "penguins_dt", "species_summary"], 1.0,
+        ))
+    return actions
+
+
+# A simulated browser session on the app's websocket
+class SimulatedSession:
+
+    def __init__(self, url, rng):
+        self.url = url
+        self.rng = rng
+        self.latencies = []  # (kind, seconds)
+        self.errors = 0
+        self.timeouts = 0
+        self._updated = {}  # output name -> time of its latest value
+        self._changed = asyncio.Event()
+
+    async def run(self, actions, tick_interval=0.05):
+        async with websockets.connect(self.url, max_size=None) as connection:
+            reader = asyncio.create_task(self._read(connection))
+            try:
+                start = time.perf_counter()
+                await connection.send(json.dumps({"method": "init", "data": INITIAL_INPUTS}))
+                await self._wait_for(OUTPUTS, start, "initial render")
+                for kind, updates, outputs, pause in actions:
+                    for update in updates:
+                        start = time.perf_counter()
+                        await connection.send(json.dumps({"method": "update", "data": update}))
+                        if update is not updates[-1]:
+                            await asyncio.sleep(tick_interval)
+                    await self._wait_for(outputs, start, kind)
+                    await asyncio.sleep(pause * self.rng.uniform(0.5, 1.5))
+            finally:
+                reader.cancel()
+
+    async def _read(self, connection):
+        async for raw in connection:
+            message = json.loads(raw)
+            now = time.perf_counter()
+            for name in message.get("values") or {}:
+                self._updated[name] = now
+            for name in message.get("errors") or {}:
+                self._updated[name] = now
+                self.errors += 1
+            self._changed.set()
+
+    async def _wait_for(self, outputs, start, kind):
+        deadline = start + STEP_TIMEOUT
+        while not all(self._updated.get(name, 0) >= start for name in outputs):
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), max(0.0, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return
+        self.latencies.append((kind, max(self._updated[name] for name in outputs) - start))
+
+
+# How long the event loop is held up: a timer that should fire every `interval` seconds records how late it is.
+# Lateness beyond a few milliseconds means something ran on the loop without yielding (e.g. a synchronous render).
+class LoopLagMonitor:
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+
+    def summary(self, blocking_threshold=0.05):
+        lags = np.array(self.lags or [0.0])
+        return {
+            "p50_s": round(float(np.percentile(lags, 50)), 4), "p99_s": round(float(np.percentile(lags, 99)), 4),
+            "max_s": round(float(lags.max()), 4),
+            "blocked_s": round(float(lags[lags > blocking_threshold].sum()), 3),  # Total lateness from stalls over the threshold
+        }
+
+
+# Resident memory of this process in bytes
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak, in KiB on Linux
+
+
+def latency_summary(latencies):
+    kinds = {}
+    for kind, seconds in latencies:
+        kinds.setdefault(kind, []).append(seconds)
+    return {
+        kind: {
+            "count": len(values),
+            **{f"p{q}_s": round(float(np.percentile(values, q)), 4) for q in (50, 90, 99)},
+            "max_s": round(max(values), 4),
+        }
+        for kind, values in sorted(kinds.items())
+    }
+
+
+async def start_in_process_server():
+    import uvicorn
+    from app import app
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task, f"ws://127.0.0.1:{port}/websocket/"
+
+
+# Run `sessions` simulated users against the app, `ramp_up` seconds apart.
+# Without a url the app is served in this process, so its memory and event loop can be measured too.
+async def load_test(sessions=10, url=None, ramp_up=0.2, seed=0):
+    server = server_task = None
+    in_process = url is None
+    if in_process:
+        server, server_task, url = await start_in_process_server()
+    monitor = LoopLagMonitor()
+    monitor_task = asyncio.create_task(monitor.run())
+    baseline_rss = rss_bytes()
+
+    async def one_session(number):
+        await asyncio.sleep(number * ramp_up)
+        rng = random.Random(seed + number)
+        session = SimulatedSession(url, rng)
+        try:
+            await session.run(user_actions(rng))
+        except (OSError, websockets.ConnectionClosed):
+            session.errors += 1
+        return session
+
+    start = time.perf_counter()
+    simulated = await asyncio.gather(*(one_session(number) for number in range(sessions)))
+    elapsed = time.perf_counter() - start
+    peak_rss = rss_bytes()
+
+    monitor_task.cancel()
+    if server is not None:
+        server.should_exit = True
+        await server_task
+
+    report = {
+        "sessions": sessions, "url": url, "in_process": in_process, "elapsed_s": round(elapsed, 2),
+        "latency": latency_summary([latency for session in simulated for latency in session.latencies]),
+        "errors": sum(session.errors for session in simulated),
+        "timeouts": sum(session.timeouts for session in simulated),
+    }
+    if in_process:
+        # The client sessions share the process, but hold little beyond their websocket
+        report["memory"] = {
+            "baseline_bytes": baseline_rss, "after_bytes": peak_rss,
+            "per_session_bytes": (peak_rss - baseline_rss) // max(1, sessions),
+        }
+        report["event_loop_lag"] = monitor.summary()
+    return report
+
+
+# Simulate concurrent users against app.py: python load_test.py [--sessions 20] [--url ws://host:port/websocket/]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test app.py with simulated browser sessions")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--url", help="Websocket URL of a running app; by default the app is served in this process")
+    parser.add_argument("--ramp-up", type=float, default=0.2, help="Seconds between session starts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(load_test(args.sessions, args.url, args.ramp_up, args.seed))
+    print(json.dumps(report, indent=1))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=1)
@@ -0,0 +1,137 @@
+from column_stats import StatsIndex
+from cross_filter import CrossFilter
+from filter_cache import SpeciesFilterCache
+from histogram_engine import HistogramEngine, histogram_traces
+from instrumentation import phase
+from scatter_engine import ScatterEngine, scatter_traces
+from startup_timing import lazy_import
+from table_pager import TablePager
+
+
+# The shared engines app.py builds at load time over the species index
+class Engines:
+
+    def __init__(self, index, columns):
+        self.index = index
+        # Shared across sessions so each distinct species selection is filtered once per process
+        self.species_filter = SpeciesFilterCache(index)
+        self.stats = StatsIndex(index, columns)  # Per-column, per-species values, ranges and quantiles
+        self.histograms = HistogramEngine(self.stats)
+        self.scatter = ScatterEngine(index)
+        # Rows inside a region brushed in the scatter plot, intersected with each output's species selection
+        self.cross_filter = CrossFilter(index, columns)
+        self.tables = TablePager(self.species_filter, self.cross_filter)
+
+    # Empty every cache, so each render is timed as it is the first time its inputs are seen.
+    # The statistics index and the cross filter's sorted-range indexes are kept: they are built once per dataset,
+    # and bench_outputs.py times them separately.
+    def clear(self):
+        for cache in [
+            self.species_filter, self.histograms.cache, self.histograms.kde_cache, self.scatter.cache,
+            self.stats.combined_cache, self.tables.sort_cache, self.tables.rows_cache,
+            self.cross_filter.cache, self.cross_filter.bitmaps,
+        ]:
+            cache.clear()
+
+
+# The render paths of app.py's outputs, as functions of the engines and the input values the outputs read.
+# app.py calls them from its render functions and bench_outputs.py times the same calls headlessly.
+# Filtering is recorded as the "filter" phase and building figures as "build";
+# caching, the render pool and the widgets stay in app.py.
+# A brush is a region drawn in the scatter plot, as its (column, low, high) ranges and the species it was drawn over,
+# or None.
+
+# An output's species selection narrowed to the brushed species, and the brushed ranges (empty without a brush)
+def brushed(selected_species, current_brush):
+    if current_brush is None:
+        return selected_species, ()
+    ranges, brush_species = current_brush
+    return [species for species in selected_species if species in brush_species], ranges
+
+
+# Histogram counts and KDEs for the selected species, from the brushed rows when there is a brush
+def histogram_counts(engines, column, selected_species, bins, combined, current_brush):
+    species, ranges = brushed(selected_species, current_brush)
+    if not ranges:
+        return engines.histograms.histogram(column, selected_species, bins, combined=combined)
+    values = engines.cross_filter.values_by(column, engines.cross_filter.rows(ranges, species=species), combined=combined)
+    return engines.histograms.restricted(column, selected_species, bins, values, combined=combined)
+
+
+def histogram_kde(engines, column, selected_species, combined, current_brush):
+    species, ranges = brushed(selected_species, current_brush)
+    if not ranges:
+        return engines.histograms.kde(column, selected_species, combined=combined)
+    values = engines.cross_filter.values_by(column, engines.cross_filter.rows(ranges, species=species), combined=combined)
+    return engines.histograms.restricted_kde(column, selected_species, values, combined=combined)
+
+
+# The Seaborn histogram's counts and KDE; "without overlay" combines the selected species into one series.
+# The KDE is cached without the bin count, so moving the bin slider reuses it.
+def plot_counts(engines, column, selected_species, bins, show_all, current_brush):
+    with phase("filter"):
+        return (
+            histogram_counts(engines, column, selected_species, bins, show_all, current_brush),
+            histogram_kde(engines, column, selected_species, show_all, current_brush),
+        )
+
+
+def plot_title(current_brush):
+    return "Palmer Penguins" if current_brush is None else "Palmer Penguins (scatter plot selection)"
+
+
+# The Plotly histogram: only one bar per bin and series is sent to the browser, not one value per row.
+# A single color combines the selected species into one series.
+def histogram_figure(engines, column, x_label, selected_species, bins, barmode, single_color_only, current_brush, color_map,
+                     single_color="#636EFA"):
+    go = lazy_import("plotly.graph_objects")
+    with phase("filter"):
+        hist = histogram_counts(engines, column, selected_species, bins, single_color_only, current_brush)
+    with phase("build"):
+        return go.Figure(
+            data=histogram_traces(hist, color_map if not single_color_only else {}, barmode, default_color=single_color)
+        ).update_layout(
+            title={"text": f"Penguin {x_label} Distribution by Species", "x": 0.5},
+            yaxis_title="Count",
+            xaxis_title=x_label,
+            barmode=barmode,
+            bargap=0 if barmode == "overlay" else None,
+            legend_title_text="species",
+        )
+
+
+# Per-species points for the scatter plot, kept up to date by the shared engine as rows are appended
+def scatter_points(engines, x_column, y_column, selected_species):
+    with phase("filter"):
+        return engines.scatter.points(x_column, y_column, selected_species)
+
+
+# Large selections switch to WebGL, downsampling or 2D bins
+def scatter_figure(points, color_map, mode, x_label, y_label):
+    go = lazy_import("plotly.graph_objects")
+    with phase("build"):
+        return go.Figure(
+            data=scatter_traces(points, color_map, mode)
+        ).update_layout(
+            title={"text": f"{x_label} vs {y_label}", "x": 0.5},
+            yaxis_title=y_label,
+            xaxis_title=x_label,
+            legend_title_text="species",
+            modebar_remove=["lasso2d"],  # Only box selections cross-filter
+        )
+
+
+# One page of the tables' filtered and sorted view, as (rows, total, page, page count)
+def paged_table(engines, selected_species, page, page_size, sort_column="", descending=False, filter_column=None,
+                filter_value="", current_brush=None):
+    species, ranges = brushed(selected_species, current_brush)
+    return engines.tables.page(
+        species, page, page_size, sort_column=sort_column, descending=descending,
+        filter_column=filter_column, filter_value=filter_value, ranges=ranges,
+    )
+
+
+# Count, missing values, range, quartiles and mean per measurement for the selected species
+def summary_rows(engines, selected_species):
+    with phase("filter"):
+        return engines.stats.summary(selected_species)
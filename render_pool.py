@@ -0,0 +1,86 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import importlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from instrumentation import phase
+
+# "inline" renders on the event loop; "pool" runs matplotlib renders in worker processes
+# and Plotly figure building in threads
+RENDER_MODE_ENV = "PENGUINS_RENDER_MODE"
+RENDER_WORKERS_ENV = "PENGUINS_RENDER_WORKERS"
+# Renders submitted to the pools at once, across all sessions; later ones wait their turn
+RENDER_QUEUE_ENV = "PENGUINS_RENDER_QUEUE"
+# Renders one session may have submitted at once
+SESSION_RENDERS_ENV = "PENGUINS_SESSION_RENDERS"
+
+# Imported by each worker process when it starts, so its first render doesn't pay for them
+WORKER_IMPORTS = ["matplotlib.figure", "matplotlib.backends.backend_agg"]
+
+
+# Runs render work off the event loop so one slow render doesn't stall every other session on the worker.
+# matplotlib renders go to a process pool (each worker process has its own matplotlib state),
+# Plotly figures are built in a thread pool. Both pools are bounded and created on first use.
+# Back-pressure: at most max_queued renders are submitted at once and at most per_session per session;
+# the rest wait on the event loop without blocking it, and the wait is recorded as the "queue" phase.
+class RenderPool:
+
+    def __init__(self, mode=None, workers=None, max_queued=None, per_session=None):
+        self.mode = mode or os.environ.get(RENDER_MODE_ENV, "inline")
+        if self.mode not in ("inline", "pool"):
+            raise ValueError(f"Unknown render mode: {self.mode!r}")
+        self.workers = int(workers or os.environ.get(RENDER_WORKERS_ENV, 0)) or os.cpu_count() or 1
+        self.max_queued = int(max_queued or os.environ.get(RENDER_QUEUE_ENV, 0)) or self.workers * 4
+        self.per_session = int(per_session or os.environ.get(SESSION_RENDERS_ENV, 2))
+        self._processes = None
+        self._threads = None
+        self._slots = None
+        self._session_slots = {}  # session id -> semaphore
+
+    # Run fn(*args, **kwargs) in a worker process; fn and its arguments must be picklable
+    async def in_process(self, session, fn, *args, **kwargs):
+        if self.mode == "inline":
+            return fn(*args, **kwargs)
+        if self._processes is None:
+            # spawn, since forking a process with running threads isn't safe
+            self._processes = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_start_worker, initargs=(WORKER_IMPORTS,),
+            )
+        return await self._submit(session, self._processes, functools.partial(fn, *args, **kwargs))
+
+    # Run fn(*args, **kwargs) in a worker thread, keeping the caller's context so phases are still recorded
+    async def in_thread(self, session, fn, *args, **kwargs):
+        if self.mode == "inline":
+            return fn(*args, **kwargs)
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(self.workers, thread_name_prefix="render")
+        context = contextvars.copy_context()
+        return await self._submit(session, self._threads, functools.partial(context.run, fn, *args, **kwargs))
+
+    async def _submit(self, session, executor, call):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_queued)
+        async with contextlib.AsyncExitStack() as slots:
+            with phase("queue"):
+                await slots.enter_async_context(self._session_semaphore(session))
+                await slots.enter_async_context(self._slots)
+            return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    def _session_semaphore(self, session):
+        if session.id not in self._session_slots:
+            self._session_slots[session.id] = asyncio.Semaphore(self.per_session)
+            session.on_ended(lambda: self._session_slots.pop(session.id, None))
+        return self._session_slots[session.id]
+
+
+def _start_worker(names):
+    for name in names:
+        importlib.import_module(name)
+    # Each worker renders one figure at a time, on a figure of its own made before its first render
+    from figure_pool import histogram_figures
+    histogram_figures.preallocate(1)
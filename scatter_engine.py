@@ -0,0 +1,179 @@
+import numpy as np
+
+from filter_cache import LRUCache
+from startup_timing import lazy_import
+
+# Past this many points the scatter plot is drawn with WebGL instead of SVG markers
+SCATTER_WEBGL_THRESHOLD = 5_000
+
+# Point budget for the downsampled mode; every non-empty grid cell keeps a point, so it can be exceeded slightly
+SCATTER_MAX_POINTS = 20_000
+
+# Grid resolution used for stratified downsampling and 2D binned rendering
+SCATTER_GRID_SIZE = 128
+
+# Open scatter plots get appended rows as trace updates up to this many points; larger ones are re-rendered,
+# since an update sends every point as float64 to each session while a render is built once and compacted
+SCATTER_UPDATE_MAX_POINTS = 5_000
+
+
+# Non-null (x, y) pairs for one species, sorted by x so a viewport is a searchsorted away
+class ScatterPoints:
+
+    def __init__(self, x, y, presorted=False):
+        if not presorted:
+            order = np.argsort(x, kind="stable")
+            x, y = x[order], y[order]
+        self.x = x
+        self.y = y
+
+    def __len__(self):
+        return len(self.x)
+
+    def in_viewport(self, x_range=None, y_range=None):
+        x, y = self.x, self.y
+        if x_range is not None:
+            start = np.searchsorted(x, x_range[0], side="left")
+            stop = np.searchsorted(x, x_range[1], side="right")
+            x, y = x[start:stop], y[start:stop]
+        if y_range is not None:
+            keep = (y >= y_range[0]) & (y <= y_range[1])
+            x, y = x[keep], y[keep]
+        return x, y
+
+    def extended(self, x, y):
+        # New points with (x, y) merged in, in x order, without re-sorting the existing points
+        order = np.argsort(x, kind="stable")
+        at = np.searchsorted(self.x, x[order], side="right")
+        return ScatterPoints(np.insert(self.x, at, x[order]), np.insert(self.y, at, y[order]), presorted=True)
+
+
+# Per-species scatter points shared by every session, cached by (x column, y column, species set)
+class ScatterEngine:
+
+    def __init__(self, index, max_entries=32):
+        self.index = index
+        self.length = index.length  # Rows the cached points were brought up to date with
+        self.cache = LRUCache(max_entries)
+
+    def points(self, x_column, y_column, selected_species):
+        # Keyed by the rows covered, so points taken while rows are appended are never served once they are
+        key = (x_column, y_column, frozenset(selected_species), self.index.length)
+        return self.cache.get_or_compute(key, lambda: self._compute(*key))
+
+    def _compute(self, x_column, y_column, selected_species, length):
+        points = {}
+        for species in self.index.species:
+            if species in selected_species:
+                points[species] = ScatterPoints(*_non_null_pairs(self.index.take([species], length), x_column, y_column))
+        return points
+
+    def extend(self, appended):
+        # Merge rows appended to the index (species -> new row positions) into the cached points,
+        # which move to the new length
+        previous, length = self.length, self.index.length
+
+        def extend_points(key, points):
+            x_column, y_column, selected_species, covered = key
+            if covered != previous:
+                return None  # Taken before the last batch was merged
+            if not selected_species & appended.keys():
+                return points
+            extended = {}
+            for species in self.index.species:
+                if species not in selected_species:
+                    continue
+                if species not in appended:
+                    extended[species] = points[species]
+                    continue
+                x, y = _non_null_pairs(self.index.data.iloc[appended[species]], x_column, y_column)
+                extended[species] = points[species].extended(x, y) if species in points else ScatterPoints(x, y)
+            return extended
+
+        self.cache.refresh(extend_points, rekey=lambda key: key[:-1] + (length,))
+        self.length = length
+
+    def reset(self):
+        self.cache.clear()
+        self.length = self.index.length
+
+
+def _non_null_pairs(rows, x_column, y_column):
+    x = rows[x_column].to_numpy(dtype=float, na_value=np.nan)
+    y = rows[y_column].to_numpy(dtype=float, na_value=np.nan)
+    keep = ~(np.isnan(x) | np.isnan(y))
+    return x[keep], y[keep]
+
+
+# Density-preserving downsampling: points are sampled per cell of a 2D grid in proportion
+# to the cell's count, and every non-empty cell keeps at least one point so outliers survive.
+# Returns the indices of the kept points.
+def downsample(x, y, max_points, grid_size=SCATTER_GRID_SIZE, seed=0):
+    if len(x) <= max_points:
+        return np.arange(len(x))
+
+    cells = _grid_cells(x, y, grid_size)
+    counts = np.bincount(cells, minlength=grid_size * grid_size)
+    quota = np.maximum(1, np.round(counts * (max_points / len(x)))).astype(np.intp)
+
+    # Shuffle, group by cell, and keep the first `quota` points of each cell
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(x)), cells))
+    sorted_cells = cells[order]
+    first_in_cell = np.searchsorted(sorted_cells, sorted_cells, side="left")
+    rank = np.arange(len(x)) - first_in_cell
+    return np.sort(order[rank < quota[sorted_cells]])
+
+
+def _grid_cells(x, y, grid_size):
+    x_low, x_high = x.min(), x.max()
+    y_low, y_high = y.min(), y.max()
+    column = np.clip(((x - x_low) / ((x_high - x_low) or 1) * grid_size).astype(np.intp), 0, grid_size - 1)
+    row = np.clip(((y - y_low) / ((y_high - y_low) or 1) * grid_size).astype(np.intp), 0, grid_size - 1)
+    return row * grid_size + column
+
+
+# Build the scatter traces for a viewport.
+# mode is "auto" (every point, WebGL past the threshold), "sample" (downsampled points),
+# or "binned" (a single 2D count heatmap computed in NumPy).
+def scatter_traces(points, colors, mode="auto", x_range=None, y_range=None, max_points=SCATTER_MAX_POINTS):
+    go = lazy_import("plotly.graph_objects")
+    visible = {species: species_points.in_viewport(x_range, y_range) for species, species_points in points.items()}
+    total = sum(len(x) for x, _ in visible.values())
+
+    if mode == "binned":
+        return [binned_trace(visible, x_range, y_range)]
+
+    traces = []
+    for species, (x, y) in visible.items():
+        if mode == "sample" and total > max_points:
+            # Each species keeps its share of the point budget
+            keep = downsample(x, y, max(1, int(max_points * len(x) / total)))
+            x, y = x[keep], y[keep]
+        trace_type = go.Scattergl if total > SCATTER_WEBGL_THRESHOLD else go.Scatter
+        traces.append(trace_type(
+            x=x, y=y, mode="markers", name=species,
+            marker_color=colors.get(species),
+        ))
+    return traces
+
+
+def binned_trace(visible, x_range=None, y_range=None, grid_size=SCATTER_GRID_SIZE):
+    go = lazy_import("plotly.graph_objects")
+    x = np.concatenate([x for x, _ in visible.values()]) if visible else np.empty(0)
+    y = np.concatenate([y for _, y in visible.values()]) if visible else np.empty(0)
+    if not len(x):
+        return go.Heatmap(z=[[]], showscale=False)
+    x_range = x_range if x_range is not None else (x.min(), x.max())
+    y_range = y_range if y_range is not None else (y.min(), y.max())
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=grid_size, range=[_widen(x_range), _widen(y_range)])
+    return go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2, y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=np.where(counts.T > 0, counts.T, np.nan),  # Empty cells stay transparent
+        colorscale="Viridis", colorbar_title="Count", name="Count",
+    )
+
+
+def _widen(value_range):
+    low, high = value_range
+    return (low - 0.5, high + 0.5) if low == high else (low, high)
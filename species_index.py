@@ -0,0 +1,231 @@
+import numpy as np
+import pandas as pd
+
+from dataset_source import common_dtype, compact_dtypes
+
+# Column buffers hold this many times the rows they were last grown to, so appends rarely reallocate them
+BUFFER_GROWTH = 2
+
+
+# Per-species row index built once at load time.
+# The species column is stored as a categorical, and the row positions for each
+# species are precomputed, so filtering by species never scans the column again.
+# Species whose rows are contiguous are kept as slices, which filter without copying.
+# The loaded (possibly memory-mapped) columns are used as they are until rows are first appended;
+# then each column moves once into a ColumnBuffer, and later batches are written in place after its last row.
+class SpeciesIndex:
+
+    def __init__(self, data, column="species"):
+        if not isinstance(data[column].dtype, pd.CategoricalDtype):
+            data = data.assign(**{column: data[column].astype("category")})
+        self.data = data
+        self.column = column
+        self.length = len(data)  # Rows the species blocks cover; set after them when rows are appended
+        self.buffers = None  # column -> ColumnBuffer, from the first append on
+        self.block_buffers = {}  # species -> buffer its scattered row positions are appended to
+
+        codes = data[column].cat.codes.to_numpy()
+        valid = codes >= 0  # Code -1 marks missing species
+        order = np.argsort(codes[valid], kind="stable")  # Stable sort keeps rows in their original order
+        positions = np.flatnonzero(valid)[order]
+        counts = np.bincount(codes[valid], minlength=len(data[column].cat.categories))
+        blocks = np.split(positions, np.cumsum(counts)[:-1])
+
+        # species -> (start, stop) when its rows are contiguous, else sorted row positions
+        self.blocks = {
+            species: _compact(rows)
+            for species, rows in zip(data[column].cat.categories, blocks)
+        }
+
+    def append(self, rows):
+        # Append rows at the end of the data and extend the species blocks with them, without re-indexing.
+        # Each batch is copied into the column buffers, and each species' new positions into its block,
+        # so it costs time in proportion to its rows rather than the table's.
+        # Categorical columns stay categorical, gaining any new categories, and numeric ones widen to hold new values.
+        # Returns species -> positions of its appended rows.
+        start = len(self.data)
+        if self.buffers is None:
+            self.buffers = {name: ColumnBuffer(series) for name, series in self.data.items()}
+        rows = rows.reset_index(drop=True)
+        # Every column is converted before any is written, so a batch that fails leaves the data unchanged
+        converted = {name: buffer.convert(rows[name]) for name, buffer in self.buffers.items()}
+        for name, buffer in self.buffers.items():
+            buffer.write(converted[name])
+        data = pd.DataFrame({name: buffer.series() for name, buffer in self.buffers.items()}, copy=False)
+
+        codes = data[self.column].array.codes[start:]
+        appended = {}
+        blocks = {}
+        for code, species in enumerate(data[self.column].cat.categories):
+            block = self.blocks.get(species, (start, start))
+            new_positions = start + np.flatnonzero(codes == code)
+            if len(new_positions):
+                appended[species] = new_positions
+                block = self._extend_block(species, block, new_positions)
+            blocks[species] = block
+
+        # Swap in the data before the blocks; the old blocks are still valid positions into the new data
+        self.data = data
+        self.blocks = blocks
+        self.length = len(data)
+        return appended
+
+    def _extend_block(self, species, block, new_positions):
+        # A slice stays a slice while the new positions continue it. Other blocks are views of a buffer
+        # with room to grow, written in place after the block's last position.
+        if isinstance(block, tuple) and len(new_positions) == new_positions[-1] - new_positions[0] + 1:
+            if block[0] == block[1]:
+                return (int(new_positions[0]), int(new_positions[-1]) + 1)
+            if block[1] == new_positions[0]:
+                return (block[0], int(new_positions[-1]) + 1)
+        length = self.count(species)
+        stop = length + len(new_positions)
+        buffer = self.block_buffers.get(species)
+        if buffer is None or not isinstance(block, np.ndarray) or block.base is not buffer or stop > len(buffer):
+            grown = np.empty(stop * BUFFER_GROWTH, dtype=np.intp)
+            grown[:length] = _positions(block)
+            buffer = self.block_buffers[species] = grown
+        buffer[length:stop] = new_positions
+        return buffer[:stop]
+
+    @property
+    def species(self):
+        return list(self.blocks)
+
+    def count(self, species):
+        block = self.blocks.get(species)
+        if block is None:
+            return 0
+        if isinstance(block, tuple):
+            return block[1] - block[0]
+        return len(block)
+
+    def positions(self, selected_species):
+        # Row positions for the selected species, in original row order
+        blocks = [self.blocks[s] for s in dict.fromkeys(selected_species) if s in self.blocks]
+        if not blocks:
+            return np.empty(0, dtype=np.intp)
+        if all(isinstance(block, tuple) for block in blocks):
+            # Contiguous blocks never interleave, so ordering them by start keeps row order
+            blocks.sort()
+            return np.concatenate([np.arange(start, stop) for start, stop in blocks])
+        rows = np.concatenate([_positions(block) for block in blocks])
+        return np.sort(rows) if len(blocks) > 1 else rows
+
+    def take(self, selected_species, length=None):
+        # Rows for the selected species, matching data[data[column].isin(selected_species)].
+        # With a length, only rows before it, e.g. the rows a cache read self.length for before taking them
+        blocks = [self.blocks[s] for s in dict.fromkeys(selected_species) if s in self.blocks]
+        if not blocks:
+            return self.data.iloc[0:0]
+        if all(isinstance(block, tuple) for block in blocks):
+            # Adjacent contiguous blocks merge into a single slice
+            blocks.sort()
+            merged = [list(blocks[0])]
+            for start, stop in blocks[1:]:
+                if start == merged[-1][1]:
+                    merged[-1][1] = stop
+                else:
+                    merged.append([start, stop])
+            if len(merged) == 1:
+                start, stop = merged[0]
+                return self.data.iloc[start:stop if length is None else max(start, min(stop, length))]
+        positions = self.positions(selected_species)
+        if length is not None:
+            positions = positions[:np.searchsorted(positions, length)]
+        return self.data.iloc[positions]
+
+
+# One column's values in a buffer with room for more rows: numeric columns as one array,
+# nullable ones as values plus a missing-value mask, categoricals as their codes.
+# Appended values are written after the last row, and the buffer is only reallocated when full.
+# series() wraps the filled part without copying; rows already wrapped are never written again,
+# so Series handed out earlier keep their values.
+class ColumnBuffer:
+
+    def __init__(self, series):
+        self._reset(series)
+
+    def _reset(self, series):
+        # Take on the series' dtype and hold its values
+        self.dtype = series.dtype
+        self.categories = series.dtype.categories if isinstance(series.dtype, pd.CategoricalDtype) else None
+        parts = self._parts(series, self.dtype, self.categories)
+        self.arrays = [np.empty(0, dtype=part.dtype) for part in parts]
+        self.length = 0
+        self.write((self.dtype, self.categories, parts))
+
+    # New values in this column's layout, as (dtype, categories, arrays). Numbers are compacted like the loaded data
+    # and widen the column's dtype when it can't hold them exactly (see common_dtype); categoricals gain new categories.
+    # Nothing changes until the result is written, so a batch that can't be converted leaves the column as it was.
+    def convert(self, series):
+        if self.categories is not None:
+            categories = self.categories
+            if not (isinstance(series.dtype, pd.CategoricalDtype) and series.dtype.categories.equals(categories)):
+                new_categories = pd.Index(series.dropna().unique()).difference(categories)
+                if len(new_categories):
+                    categories = categories.append(new_categories)
+            dtype = pd.CategoricalDtype(categories)
+        elif series.dtype == self.dtype:
+            dtype, categories = self.dtype, None
+        else:
+            dtype, categories = common_dtype(self.dtype, compact_dtypes(series.to_frame())[series.name].dtype), None
+        return dtype, categories, self._parts(series, dtype, categories)
+
+    def write(self, converted):
+        dtype, categories, parts = converted
+        if categories is None and dtype != self.dtype:
+            # Widened: the rows so far are converted to the new dtype once
+            self._reset(self.series().astype(dtype))
+        self.dtype, self.categories = dtype, categories
+        stop = self.length + len(parts[0])
+        if stop > len(self.arrays[0]) or any(part.dtype != array.dtype for part, array in zip(parts, self.arrays)):
+            self._grow(stop, [np.promote_types(part.dtype, array.dtype) for part, array in zip(parts, self.arrays)])
+        for part, array in zip(parts, self.arrays):
+            array[self.length:stop] = part
+        self.length = stop
+
+    def _grow(self, rows, dtypes):
+        grown = []
+        for array, dtype in zip(self.arrays, dtypes):
+            new_array = np.empty(max(rows * BUFFER_GROWTH, 16), dtype=dtype)
+            new_array[:self.length] = array[:self.length]
+            grown.append(new_array)
+        self.arrays = grown
+
+    @staticmethod
+    def _parts(series, dtype, categories):
+        if categories is not None:
+            if isinstance(series.dtype, pd.CategoricalDtype) and series.dtype.categories.equals(categories):
+                return [series.array.codes]
+            return [pd.Categorical(series, categories=categories).codes]
+        series = series.astype(dtype)
+        if _masked(dtype):
+            return [series.to_numpy(dtype=dtype.numpy_dtype, na_value=0), series.isna().to_numpy()]
+        return [series.to_numpy()]
+
+    def series(self):
+        parts = [array[:self.length] for array in self.arrays]
+        if self.categories is not None:
+            values = pd.Categorical.from_codes(parts[0], dtype=self.dtype, validate=False)
+        elif _masked(self.dtype):
+            values = self.dtype.construct_array_type()(*parts)
+        else:
+            values = parts[0]
+        return pd.Series(values, copy=False)
+
+
+# Nullable integer, float and boolean dtypes, stored as values plus a mask
+def _masked(dtype):
+    return pd.api.types.is_extension_array_dtype(dtype) and hasattr(dtype, "numpy_dtype")
+
+
+# A block as (start, stop) when its sorted positions are contiguous
+def _compact(positions):
+    if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+        return (int(positions[0]), int(positions[-1]) + 1)
+    return positions
+
+
+def _positions(block):
+    return np.arange(*block) if isinstance(block, tuple) else block
@@ -0,0 +1,75 @@
+import importlib
+import json
+import logging
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger("penguins.startup")
+
+_started = time.perf_counter()
+_last_mark = _started
+_phases = {}  # phase label -> seconds
+_lock = threading.Lock()
+
+
+# Record the time since the previous mark (or since this module was imported) under a phase label.
+# Import this module first so the phases cover the whole app import.
+def mark(label):
+    global _last_mark
+    now = time.perf_counter()
+    with _lock:
+        _phases[label] = _phases.get(label, 0.0) + (now - _last_mark)
+        _last_mark = now
+
+
+# Import a module the first time an output needs it, and record how long that first import took
+def lazy_import(name):
+    module = sys.modules.get(name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        with _lock:
+            _phases[f"lazy import {name}"] = time.perf_counter() - start
+    return module
+
+
+def report():
+    with _lock:
+        return {
+            "total_s": round(_last_mark - _started, 4),
+            "phases_s": {label: round(seconds, 4) for label, seconds in _phases.items()},
+        }
+
+
+def log_report():
+    logger.info(json.dumps({"event": "startup", **report()}))
+
+
+# Per-package import cost of a module, measured in a fresh interpreter with -X importtime.
+# Self times are summed by top-level package, so nested imports aren't counted twice.
+# Returns (package, seconds) pairs, slowest first.
+def import_breakdown(module="app"):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        self_time, _, name = line[len("import time:"):].split("|")
+        if self_time.strip().isdigit():
+            package = name.strip().split(".")[0]
+            packages[package] = packages.get(package, 0.0) + int(self_time) / 1e6
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+# Print the import breakdown for a module: python startup_timing.py [module]
+if __name__ == "__main__":
+    module = sys.argv[1] if len(sys.argv) > 1 else "app"
+    breakdown = import_breakdown(module)
+    print(f"Import time for {module}: {sum(seconds for _, seconds in breakdown):.3f}s")
+    for package, seconds in breakdown[:20]:
+        print(f"  {package:<30} {seconds:8.3f}s")
@@ -0,0 +1,148 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from filter_cache import LRUCache
+
+# Numeric column filters: "4000", ">4000", "<= 40.5" or a range like "3000..4000"
+NUMERIC_FILTER = re.compile(r"^\s*(<=|>=|<|>|=)?\s*(-?\d+(?:\.\d*)?)\s*$")
+NUMERIC_RANGE = re.compile(r"^\s*(-?\d+(?:\.\d*)?)\s*\.\.\s*(-?\d+(?:\.\d*)?)\s*$")
+
+
+# Server-side paging for the DataGrid and DataTable outputs.
+# The filtered view stays on the server and only one page of rows is sent to the client.
+# Sort permutations and filtered row sets are cached per species selection and shared
+# by every session, so turning pages is O(page size) no matter how large the table is.
+# With ranges (a region brushed in the scatter plot) the rows come from a CrossFilter instead,
+# and sorting and filtering cover only the rows inside them.
+# Cached rows are keyed by the rows covered, read once per page before anything is computed,
+# so rows computed while more are appended are never served once they are.
+class TablePager:
+
+    def __init__(self, filter_cache, cross_filter=None, max_entries=32):
+        self.filter_cache = filter_cache
+        self.cross_filter = cross_filter
+        self.sort_cache = LRUCache(max_entries)
+        self.rows_cache = LRUCache(max_entries)
+
+    def rows(self, selected_species, sort_column=None, descending=False, filter_column=None, filter_value="", ranges=(),
+             length=None):
+        # Row positions into the filtered view of the first `length` rows (all rows covered by default),
+        # or None when it is shown unsorted and unfiltered. With ranges they are positions into the whole table.
+        filter_value = filter_value.strip() if filter_column else ""
+        if not sort_column and not filter_value and not ranges:
+            return None
+        if length is None:
+            length = self.length(ranges)
+        key = (frozenset(selected_species), sort_column, bool(descending), filter_column, filter_value, tuple(ranges), length)
+        return self.rows_cache.get_or_compute(key, lambda: self._rows(*key))
+
+    # Rows covered: by the cross filter with ranges, otherwise by the species index
+    def length(self, ranges=()):
+        return self.cross_filter.length if ranges else self.filter_cache.index.length
+
+    def _rows(self, selected_species, sort_column, descending, filter_column, filter_value, ranges, length):
+        if ranges:
+            return self._rows_within(selected_species, sort_column, descending, filter_column, filter_value, ranges)
+        view = self.filter_cache.get(selected_species, length)
+        if sort_column:
+            positions = self.sort_cache.get_or_compute(
+                (selected_species, sort_column, descending, length),
+                lambda: sort_permutation(view[sort_column], descending)
+            )
+        else:
+            positions = np.arange(len(view))
+        if filter_value:
+            keep = column_filter_mask(view[filter_column], filter_value)
+            positions = positions[keep[positions]]
+        return positions
+
+    def _rows_within(self, selected_species, sort_column, descending, filter_column, filter_value, ranges):
+        # Only the rows inside the ranges are filtered and sorted, reading just the columns involved.
+        # Measurements are sorted from the cross filter's sorted-range index.
+        rows = self.cross_filter.rows(ranges, species=selected_species)
+        data = self.filter_cache.data
+        if filter_value:
+            rows = rows[column_filter_mask(data[filter_column].iloc[rows], filter_value)]
+        if sort_column in self.cross_filter.columns:
+            rows = self.cross_filter.ordered(sort_column, rows, descending)
+        elif sort_column:
+            rows = rows[sort_permutation(data[sort_column].iloc[rows], descending)]
+        return rows
+
+    def clear(self):
+        self.sort_cache.clear()
+        self.rows_cache.clear()
+
+    def page(self, selected_species, page, page_size, ranges=(), **options):
+        # One page of rows plus the total row count; page numbers start at 1 and are truncated to whole pages and clamped,
+        # since a numeric input can give a float
+        length = self.length(ranges)
+        positions = self.rows(selected_species, ranges=ranges, length=length, **options)
+        # Appended rows only ever come after the rows covered, so positions into the whole table stay valid
+        view = self.filter_cache.data if ranges else self.filter_cache.get(selected_species, length)
+        total = len(view) if positions is None else len(positions)
+
+        page_count = max(1, -(-total // page_size))
+        page = min(max(1, int(page)), page_count)
+        start, stop = (page - 1) * page_size, min(page * page_size, total)
+
+        if positions is None:
+            rows = view.iloc[start:stop]
+        else:
+            rows = view.iloc[positions[start:stop]]
+        return display_rows(rows), total, page, page_count
+
+
+# Stable sort order with missing values last in both directions
+def sort_permutation(series, descending=False):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        keys = series.cat.codes.to_numpy()
+    elif pd.api.types.is_extension_array_dtype(series) and pd.api.types.is_numeric_dtype(series):
+        keys = series.to_numpy(dtype=float, na_value=np.nan)  # Nullable integers
+    else:
+        keys = series.to_numpy()
+    missing = series.isna().to_numpy()
+    present = np.flatnonzero(~missing)
+
+    # Dense ranks let descending order be a stable sort on the negated ranks
+    _, ranks = np.unique(keys[present], return_inverse=True)
+    order = present[np.argsort(-ranks if descending else ranks, kind="stable")]
+    return np.concatenate([order, np.flatnonzero(missing)])
+
+
+# Boolean mask for a column filter: numeric comparisons for numeric columns, case-insensitive substring otherwise
+def column_filter_mask(series, value):
+    if pd.api.types.is_numeric_dtype(series):
+        # float32 columns are compared at their own precision, so "39.1" matches a stored 39.1
+        values = series.to_numpy(dtype=np.float32 if series.dtype == np.float32 else np.float64, na_value=np.nan)
+        number_type = values.dtype.type
+        match = NUMERIC_RANGE.match(value)
+        if match:
+            low, high = number_type(match.group(1)), number_type(match.group(2))
+            return (values >= low) & (values <= high)
+        match = NUMERIC_FILTER.match(value)
+        if match:
+            operator, number = match.group(1) or "=", number_type(match.group(2))
+            return {
+                "=": values == number, "<": values < number, ">": values > number,
+                "<=": values <= number, ">=": values >= number,
+            }[operator]
+    return series.astype(str).str.contains(value, case=False, regex=False).to_numpy() & series.notna().to_numpy()
+
+
+# Widen float32 columns for display at their shortest float32 representation, so 39.1 is sent as 39.1,
+# and send nullable integer columns as floats with NaN for missing values, which the DataGrid would otherwise get as strings
+def display_rows(rows):
+    float32_columns = [name for name, dtype in rows.dtypes.items() if dtype == np.float32]
+    nullable_columns = [
+        name for name, dtype in rows.dtypes.items()
+        if pd.api.types.is_extension_array_dtype(dtype) and pd.api.types.is_integer_dtype(dtype)
+    ]
+    if not float32_columns and not nullable_columns:
+        return rows
+    return rows.assign(
+        **{name: rows[name].to_numpy().astype(str).astype(np.float64) for name in float32_columns},
+        **{name: rows[name].to_numpy(dtype=np.float64, na_value=np.nan) for name in nullable_columns},
+    )
@@ -0,0 +1,254 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cross_filter import SCAN_RATIO
+from dataset_source import compact_dtypes
+from dataset_stream import DatasetStream
+from output_renders import Engines
+from species_index import SpeciesIndex
+
+COLUMNS = ["bill_length_mm", "body_mass_g"]
+SELECTIONS = [["Adelie"], ["Gentoo"], ["Adelie", "Chinstrap"], ["Adelie", "Chinstrap", "Gentoo"], ["Emperor"]]
+
+
+# Tests that rows appended through a DatasetStream give the species index and the shared engines
+# what recomputing them from the whole table would: isin and boolean masks for row sets,
+# np.histogram for counts, and stable sorts for orderings.
+
+
+# A small penguins-like table; the first rows of each species are contiguous, the rest interleaved
+def penguins(rows, seed=0, species=("Adelie", "Chinstrap", "Gentoo")):
+    rng = np.random.default_rng(seed)
+    names = np.sort(rng.choice(species, rows // 2)).tolist() + rng.choice(species, rows - rows // 2).tolist()
+    bill = np.round(rng.uniform(32, 60, rows), 1)
+    bill[rng.random(rows) < 0.05] = np.nan
+    return pd.DataFrame({
+        "species": names,
+        "island": rng.choice(["Biscoe", "Dream", "Torgersen"], rows),
+        "bill_length_mm": bill,
+        "body_mass_g": rng.integers(27, 63, rows) * 100,  # Many ties
+        "sex": rng.choice(["male", "female"], rows),
+        "year": rng.integers(2007, 2010, rows),
+    })
+
+
+class Source:
+    path = None
+
+    def cache_key(self):
+        return "test"
+
+
+# A stream over a compacted table whose engines have cached results for every selection,
+# so appending has entries to merge rows into rather than only compute from scratch
+def warm_stream(data):
+    index = SpeciesIndex(compact_dtypes(data))
+    engines = Engines(index, COLUMNS)
+    stream = DatasetStream(
+        Source(), index,
+        engines=[engines.stats, engines.histograms, engines.scatter, engines.cross_filter],
+        caches=[engines.species_filter, engines.tables],
+    )
+    for column in COLUMNS:
+        engines.cross_filter.sorted_index(column)
+        for species in SELECTIONS:
+            engines.histograms.histogram(column, species, 10)
+            engines.histograms.histogram(column, species, 10, combined=True)
+    return stream, engines
+
+
+def float_values(series):
+    return series.to_numpy(dtype=float, na_value=np.nan)
+
+
+def naive_rows(data, species):
+    return np.flatnonzero(data["species"].isin(species).to_numpy())
+
+
+def labels(series):
+    return [None if pd.isna(value) else value for value in series.astype(object)]
+
+
+def assert_same_data(index, expected):
+    for name in expected.columns:
+        if name in ("species", "island", "sex"):
+            assert labels(index.data[name]) == labels(expected[name])
+        else:
+            # Loaded measurements may be held as float32, exact to their written precision
+            np.testing.assert_allclose(float_values(index.data[name]), float_values(expected[name]), rtol=1e-6)
+
+
+def test_take_matches_isin_after_appends():
+    data = penguins(400)
+    stream, engines = warm_stream(data)
+    batches = [
+        penguins(30, seed=1),
+        penguins(1, seed=2, species=("Gentoo",)),
+        penguins(12, seed=3, species=("Emperor",)),  # A species new to the table
+        penguins(50, seed=4),
+    ]
+    for batch in batches:
+        stream.append(batch)
+    expected = pd.concat([data] + batches, ignore_index=True)
+    assert_same_data(stream.index, expected)
+    for species in SELECTIONS:
+        rows = naive_rows(expected, species)
+        np.testing.assert_array_equal(stream.index.positions(species), rows)
+        assert stream.index.take(species).index.tolist() == rows.tolist()
+        assert len(engines.species_filter.get(species)) == len(rows)
+    assert stream.index.count("Emperor") == 12
+
+
+def test_extend_block_keeps_contiguous_slices_and_buffers_scattered_rows():
+    data = pd.DataFrame({"species": ["Adelie"] * 4 + ["Gentoo"] * 4, "bill_length_mm": np.arange(8.0)})
+    index = SpeciesIndex(data)
+    assert index.blocks == {"Adelie": (0, 4), "Gentoo": (4, 8)}
+
+    index.append(pd.DataFrame({"species": ["Gentoo"] * 3, "bill_length_mm": [1.0, 2.0, 3.0]}))
+    assert index.blocks["Gentoo"] == (4, 11)  # Continues its slice
+    index.append(pd.DataFrame({"species": ["Adelie", "Gentoo", "Adelie"], "bill_length_mm": [1.0, 2.0, 3.0]}))
+    assert isinstance(index.blocks["Adelie"], np.ndarray)
+    assert isinstance(index.blocks["Gentoo"], np.ndarray)
+    kept = index.blocks["Adelie"]
+    for seed in range(5):
+        batch = penguins(7, seed=seed, species=("Adelie", "Gentoo"))[["species", "bill_length_mm"]]
+        index.append(batch)
+    data = index.data
+    for species in ("Adelie", "Gentoo"):
+        np.testing.assert_array_equal(index.positions([species]), naive_rows(data, [species]))
+    # Blocks handed out earlier still hold the rows they had
+    np.testing.assert_array_equal(kept, [0, 1, 2, 3, 11, 13])
+
+
+def test_appended_rows_widen_columns():
+    data = penguins(40)
+    stream, engines = warm_stream(data)
+    before = stream.index.data["body_mass_g"]
+    assert before.dtype == np.int16
+    batches = [
+        pd.DataFrame({"species": ["Gentoo"], "island": ["Biscoe"], "bill_length_mm": [50.0], "body_mass_g": [40000],
+                      "sex": ["male"], "year": [2009]}),  # Too large for int16
+        pd.DataFrame({"species": ["Adelie"], "island": ["Dream"], "bill_length_mm": [39.123456789], "body_mass_g": [3750.5],
+                      "sex": [None], "year": [np.nan]}),  # Fractions, more digits than float32 holds, and missing values
+    ]
+    for batch in batches:
+        stream.append(batch)
+    expected = pd.concat([data] + batches, ignore_index=True)
+    assert_same_data(stream.index, expected)
+    assert stream.index.data["year"].isna().tolist() == expected["year"].isna().tolist()
+    assert stream.index.data["bill_length_mm"].iloc[-1] == 39.123456789
+    assert stream.index.data["body_mass_g"].iloc[-2:].tolist() == [40000, 3750.5]
+    assert before.dtype == np.int16 and len(before) == 40  # Series read before the appends are unchanged
+    for column in COLUMNS:
+        np.testing.assert_array_equal(engines.cross_filter.column_values(column), float_values(stream.index.data[column]))
+
+
+def assert_histograms_match(engines, data):
+    for column in COLUMNS:
+        for species in SELECTIONS:
+            selected = data[data["species"].isin(species)]
+            values = {name: float_values(group[column]) for name, group in selected.groupby("species", observed=True)}
+            values = {name: series[~np.isnan(series)] for name, series in values.items()}
+            everything = np.concatenate(list(values.values()) or [np.empty(0)])
+            if not len(everything):
+                continue
+            low, high = everything.min(), everything.max()
+            edges = np.linspace(low, high, 11) if low < high else np.linspace(low - 0.5, high + 0.5, 11)
+
+            hist = engines.histograms.histogram(column, species, 10)
+            np.testing.assert_allclose(hist.edges, edges)
+            for name, series in values.items():
+                np.testing.assert_array_equal(hist.counts[name], np.histogram(series, edges)[0])
+            combined = engines.histograms.histogram(column, species, 10, combined=True)
+            np.testing.assert_array_equal(combined.counts["All"], np.histogram(everything, edges)[0])
+            assert engines.stats.combined(column, species).count == len(everything)
+
+
+def test_histograms_match_np_histogram_after_appends():
+    data = penguins(300)
+    stream, engines = warm_stream(data)
+    # Values inside every range (counts are added on the same edges), then outside it (recomputed)
+    inside = penguins(20, seed=5)
+    inside["bill_length_mm"] = 45.0
+    inside["body_mass_g"] = 4500
+    batches = [inside, penguins(25, seed=6), penguins(5, seed=7, species=("Emperor",))]
+    for batch in batches:
+        stream.append(batch)
+        data = pd.concat([data, batch], ignore_index=True)
+        assert_same_data(stream.index, data)
+        assert_histograms_match(engines, stream.index.data)
+
+
+def test_sorted_range_index_merges_appended_rows():
+    data = penguins(500)
+    stream, engines = warm_stream(data)
+    for seed in range(3):
+        batch = penguins(40, seed=10 + seed)
+        stream.append(batch)
+        data = pd.concat([data, batch], ignore_index=True)
+    for column in COLUMNS:
+        values = float_values(stream.index.data[column])
+        present = np.flatnonzero(~np.isnan(values))
+        # Ties in row order, like a stable sort of the whole column
+        expected = present[np.argsort(values[present], kind="stable")]
+        order, sorted_values = engines.cross_filter.sorted_index(column)
+        np.testing.assert_array_equal(order, expected)
+        np.testing.assert_array_equal(sorted_values, values[expected])
+
+
+@pytest.mark.parametrize("narrow", [True, False])
+def test_rows_match_masks(narrow):
+    data = penguins(2000)
+    stream, engines = warm_stream(data)
+    batch = penguins(100, seed=20)
+    stream.append(batch)
+    data = pd.concat([data, batch], ignore_index=True)
+    cross_filter = engines.cross_filter
+
+    bill, mass = float_values(data["bill_length_mm"]), float_values(data["body_mass_g"])
+    ranges = [("bill_length_mm", 40.0, 41.0), ("body_mass_g", 3000, 5000)] if narrow else [("bill_length_mm", 35.0, 58.0)]
+    keep = np.ones(len(data), dtype=bool)
+    for column, low, high in ranges:
+        values = float_values(data[column])
+        keep &= (values >= low) & (values <= high)
+    assert (keep.sum() * SCAN_RATIO <= len(data)) == narrow
+
+    scans = cross_filter.scans
+    for species in SELECTIONS:
+        expected = np.flatnonzero(keep & data["species"].isin(species).to_numpy())
+        np.testing.assert_array_equal(cross_filter.rows(ranges, species=species), expected)
+    assert (cross_filter.scans == scans) == narrow
+    assert len(bill) == len(mass) == cross_filter.length
+
+
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("count", [20, 1500])  # Sorted directly, and read off the sorted-range index
+def test_ordered_keeps_ties_in_row_order(descending, count):
+    data = penguins(1900)
+    stream, engines = warm_stream(data)
+    batch = penguins(100, seed=30)
+    stream.append(batch)
+    data = pd.concat([data, batch], ignore_index=True)
+
+    rows = np.sort(np.random.default_rng(count).choice(len(data), count, replace=False))
+    for column in COLUMNS:
+        values = float_values(data[column])[rows]
+        present = ~np.isnan(values)
+        keys = -values[present] if descending else values[present]
+        expected = np.concatenate([rows[present][np.lexsort((rows[present], keys))], rows[~present]])
+        np.testing.assert_array_equal(engines.cross_filter.ordered(column, rows, descending), expected)
+
+
+def test_table_pages_match_sorted_frame():
+    data = penguins(600)
+    stream, engines = warm_stream(data)
+    batch = penguins(60, seed=40)
+    stream.append(batch)
+    data = pd.concat([data, batch], ignore_index=True)
+    for species in SELECTIONS[:4]:
+        selected = data[data["species"].isin(species)]
+        expected = selected.sort_values("body_mass_g", ascending=False, kind="stable", na_position="last")
+        rows, total, _, _ = engines.tables.page(species, 1, 1000, sort_column="body_mass_g", descending=True)
+        assert total == len(selected)
+        assert rows["body_mass_g"].tolist() == expected["body_mass_g"].tolist()
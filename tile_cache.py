@@ -0,0 +1,211 @@
+import hashlib
+import logging
+import math
+import os
+import tempfile
+import urllib.request
+
+from filter_cache import LRUCache
+
+logger = logging.getLogger("penguins.tiles")
+
+# "remote" loads tiles and the marker icon straight from their servers in the browser;
+# "local" serves them from the app, fetching and caching any that aren't on disk yet;
+# "offline" serves only what is already on disk, for deployments without network access
+TILE_MODE_ENV = "PENGUINS_TILE_MODE"
+TILE_DIR_ENV = "PENGUINS_TILE_DIR"
+TILE_CACHE_MB_ENV = "PENGUINS_TILE_CACHE_MB"
+DEFAULT_TILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tile_cache")
+
+TILE_URL = "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"
+ICON_URL = "https://cdn.pixabay.com/photo/2024/03/27/17/35/penguin-8659564_1280.png"
+
+# Browsers may reuse a tile or icon for this long without asking again
+CACHE_MAX_AGE = 30 * 24 * 3600
+
+# Deepest zoom level the imagery has
+MAX_TILE_ZOOM = 18
+
+
+# Satellite tiles and the marker icon on local disk, served by the app.
+# Files are kept in an LRU bounded by total size; least recently served tiles are deleted first.
+# Offline, the files on disk can't be fetched again, so they are never deleted.
+# Responses carry long-lived Cache-Control headers and ETags, so browsers fetch each tile at most once.
+# Only tiles at zooms min_zoom..max_zoom inside bounds, ((south, west), (north, east)), are served,
+# so the app is not an open proxy for the imagery server; the map's tile layer gets the same limits (see layer_limits).
+class TileCache:
+
+    def __init__(self, mode=None, directory=None, max_bytes=None, tile_url=TILE_URL, icon_url=ICON_URL,
+                 bounds=None, min_zoom=0, max_zoom=MAX_TILE_ZOOM):
+        self.mode = mode or os.environ.get(TILE_MODE_ENV, "remote")
+        if self.mode not in ("remote", "local", "offline"):
+            raise ValueError(f"Unknown tile mode: {self.mode!r}")
+        self.directory = directory or os.environ.get(TILE_DIR_ENV, DEFAULT_TILE_DIR)
+        self.bounds = bounds
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(TILE_CACHE_MB_ENV, 256)) * 2 ** 20)
+        self.upstream_tile_url = tile_url
+        self.upstream_icon_url = icon_url
+        self.files = LRUCache(
+            max_entries=1_000_000, max_bytes=max_bytes, sizeof=os.path.getsize,
+            on_evict=None if self.mode == "offline" else _remove_file,
+        )
+        if self.mode != "remote":
+            self._load_existing()
+
+    # URLs for the map: relative paths on the app's own server, or the upstream servers in remote mode
+    @property
+    def tile_url(self):
+        return self.upstream_tile_url if self.mode == "remote" else "tiles/{z}/{y}/{x}"
+
+    @property
+    def icon_url(self):
+        return self.upstream_icon_url if self.mode == "remote" else "tiles/icons/penguin.png"
+
+    # Options that keep a map and its tile layer to the tiles served; none in remote mode
+    @property
+    def layer_limits(self):
+        if self.mode == "remote":
+            return {}
+        limits = {"min_zoom": self.min_zoom, "max_zoom": self.max_zoom}
+        if self.bounds is not None:
+            limits["bounds"] = [list(corner) for corner in self.bounds]
+        return limits
+
+    # Whether a tile exists and lies in the area served
+    def allowed(self, z, x, y):
+        if not (self.min_zoom <= z <= self.max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return False
+        if self.bounds is None:
+            return True
+        (south, west), (north, east) = self.bounds
+        x_low, y_low = tile_xy(north, west, z)
+        x_high, y_high = tile_xy(south, east, z)
+        return x_low <= x <= x_high and y_low <= y <= y_high
+
+    def _load_existing(self):
+        # Register files already on disk, least recently used first, so the budget covers them too
+        paths = []
+        for root, _, names in os.walk(self.directory):
+            paths.extend(os.path.join(root, name) for name in names if not name.startswith("."))
+        for path in sorted(paths, key=lambda path: os.stat(path).st_atime):
+            self.files.get_or_compute(path, lambda: path)
+
+    def tile_path(self, z, x, y):
+        return os.path.join(self.directory, str(z), str(y), f"{x}.jpg")
+
+    @property
+    def icon_path(self):
+        return os.path.join(self.directory, "icons", "penguin.png")
+
+    # Path of the tile on disk, fetching it first unless offline; raises FileNotFoundError when unavailable
+    # and ValueError outside the area served
+    def tile(self, z, x, y):
+        if not self.allowed(z, x, y):
+            raise ValueError(f"Tile {z}/{y}/{x} is outside the area served")
+        return self._file(self.tile_path(z, x, y), self.upstream_tile_url.format(z=z, x=x, y=y))
+
+    def icon(self):
+        return self._file(self.icon_path, self.upstream_icon_url)
+
+    def _file(self, path, url):
+        def fetch():
+            if not os.path.exists(path):
+                if self.mode == "offline":
+                    raise FileNotFoundError(path)
+                _download(url, path)
+            return path
+        return self.files.get_or_compute(path, fetch)
+
+    # Download the tiles that cover the given (lat, lon) centers at each zoom level, `radius` tiles around each,
+    # plus the icon. Tiles outside the area served are skipped. Returns the number of files fetched.
+    def seed(self, centers, zooms, radius=2):
+        fetched = 0
+        targets = [(self.icon_path, self.upstream_icon_url)]
+        for z in zooms:
+            for lat, lon in centers:
+                center_x, center_y = tile_xy(lat, lon, z)
+                for x in range(center_x - radius, center_x + radius + 1):
+                    for y in range(max(0, center_y - radius), min(2 ** z - 1, center_y + radius) + 1):
+                        if self.allowed(z, x % 2 ** z, y):
+                            targets.append((self.tile_path(z, x % 2 ** z, y), self.upstream_tile_url.format(z=z, x=x % 2 ** z, y=y)))
+        for path, url in dict(targets).items():
+            if not os.path.exists(path):
+                _download(url, path)
+                fetched += 1
+            self.files.get_or_compute(path, lambda: path)
+        return fetched
+
+    # Starlette endpoints for the tiles and the icon
+    async def tile_endpoint(self, request):
+        params = request.path_params
+        return await self._respond(request, self.tile, params["z"], params["x"], params["y"], media_type="image/jpeg")
+
+    async def icon_endpoint(self, request):
+        return await self._respond(request, self.icon, media_type="image/png")
+
+    async def _respond(self, request, get_file, *args, media_type):
+        from starlette.concurrency import run_in_threadpool
+        from starlette.responses import FileResponse, Response
+
+        try:
+            path = await run_in_threadpool(get_file, *args)  # Downloads block, so keep them off the event loop
+            stat = os.stat(path)  # The file may have been evicted meanwhile
+        except (OSError, ValueError) as error:
+            logger.debug("Tile unavailable: %s", error)
+            return Response(status_code=404, headers={"Cache-Control": "no-store"})
+        etag = '"' + hashlib.sha1(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:16] + '"'
+        headers = {"Cache-Control": f"public, max-age={CACHE_MAX_AGE}, immutable", "ETag": etag}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    def stats(self):
+        return {"mode": self.mode, **self.files.stats()}
+
+
+# Web Mercator tile column and row containing a point
+def tile_xy(lat, lon, z):
+    n = 2 ** z
+    x = int((lon + 180) / 360 * n)
+    lat_radians = math.radians(lat)
+    y = int((1 - math.asinh(math.tan(lat_radians)) / math.pi) / 2 * n)
+    return x, y
+
+
+def _download(url, path):
+    # Written to a uniquely named hidden file next to the target and renamed, so a half-downloaded file is never served
+    # and concurrent downloads of the same tile never write to the same file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    request = urllib.request.Request(url, headers={"User-Agent": "penguins-tile-cache"})
+    with urllib.request.urlopen(request, timeout=20) as response:
+        content = response.read()
+    staging_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".part", delete=False)
+    try:
+        with staging_file:
+            staging_file.write(content)
+        os.replace(staging_file.name, path)
+    except OSError:
+        _remove_file(staging_file.name)
+        raise
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Pre-seed the tiles the app's map shows (its starting view and each island): python tile_cache.py [radius]
+if __name__ == "__main__":
+    import sys
+
+    from app import ISLAND_ZOOM, MAP_CENTER, MAP_ZOOM, island_coordinates
+
+    cache = TileCache(mode="local")
+    radius = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    fetched = cache.seed([MAP_CENTER], [MAP_ZOOM], radius) + cache.seed(island_coordinates.values(), [MAP_ZOOM, ISLAND_ZOOM], radius)
+    print(f"Fetched {fetched} files into {cache.directory} ({cache.files.bytes / 2 ** 20:.1f} MB cached)")
@@ -0,0 +1,130 @@
+import base64
+import os
+
+import numpy as np
+
+from filter_cache import LRUCache
+from instrumentation import note
+from startup_timing import lazy_import
+
+# "inline" sends the Plotly widget's JavaScript bundle (about 5 MB) with every figure widget it opens;
+# "url" has each widget import it from the app instead, so the browser downloads it once and caches it
+WIDGET_BUNDLE_ENV = "PENGUINS_WIDGET_BUNDLE"
+# Address the app is served at in url mode, e.g. https://example.org/penguins/; without it the bundle URL
+# is built from the address each client reports
+WIDGET_BASE_URL_ENV = "PENGUINS_WIDGET_BASE_URL"
+
+# Largest change float32 may make to a value, relative to the spread of the array's values.
+# Far below a pixel, and below the precision Plotly shows on hover.
+FLOAT32_TOLERANCE = 1e-6
+
+INTEGER_DTYPES = [np.int8, np.int16, np.int32]
+
+
+# Plotly figure JSON with every float64 array narrowed to the smallest dtype that keeps its values:
+# integral values as int8/16/32, other values as float32 when within FLOAT32_TOLERANCE.
+# Plotly writes numpy arrays as base64 typed arrays ("bdata") in their own dtype, and plotly.js reads them
+# back as typed arrays, so this shrinks what is sent and parsed without changing what is drawn.
+# The JSON is written with orjson when it is installed. Returns the JSON and its size before compacting.
+def compact_figure(figure):
+    pio = lazy_import("plotly.io")
+    spec = figure.to_plotly_json()
+    saved = sum(_compact_arrays(spec["data"]))
+    figure_json = pio.to_json(spec, validate=False)
+    return figure_json, len(figure_json) + saved
+
+
+# Record a figure's JSON size before and after compacting on the render's metrics
+def note_payload_sizes(figure_json, uncompacted_bytes):
+    note("uncompacted_bytes", uncompacted_bytes)
+    note("compacted_bytes", len(figure_json))
+
+
+def compact_figure_json(figure):
+    figure_json, uncompacted_bytes = compact_figure(figure)
+    note_payload_sizes(figure_json, uncompacted_bytes)
+    return figure_json
+
+
+def _compact_arrays(node):
+    # Narrow typed arrays in place, yielding the base64 characters saved by each
+    if isinstance(node, dict):
+        if node.get("dtype") == "f8" and "bdata" in node:
+            compacted = compact_array(np.frombuffer(base64.b64decode(node["bdata"]), dtype=np.float64))
+            if compacted.dtype != np.float64:
+                bdata = base64.b64encode(compacted.tobytes()).decode("ascii")
+                yield len(node["bdata"]) - len(bdata)
+                node["dtype"] = compacted.dtype.str[1:]  # e.g. "f4", "i2"
+                node["bdata"] = bdata
+            return
+        for value in node.values():
+            yield from _compact_arrays(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _compact_arrays(value)
+
+
+def compact_array(values):
+    finite = values[np.isfinite(values)]
+    if not len(finite):
+        return values
+    if len(finite) == len(values) and np.array_equal(finite, np.round(finite)):
+        for dtype in INTEGER_DTYPES:
+            limits = np.iinfo(dtype)
+            if limits.min <= finite.min() and finite.max() <= limits.max:
+                return values.astype(dtype)
+    narrowed = values.astype(np.float32)
+    spread = float(finite.max() - finite.min()) or float(np.abs(finite).max()) or 1.0
+    if np.nanmax(np.abs(narrowed[np.isfinite(values)] - finite)) <= FLOAT32_TOLERANCE * spread:
+        return narrowed
+    return values
+
+
+# FigureWidgets whose JavaScript is imported from the app's /widgets/ route rather than sent inline.
+# anywidget imports an _esm that is an http(s) URL as a module, so the browser caches it across widgets and sessions.
+class WidgetBundle:
+
+    def __init__(self, mode=None, base_url=None, max_classes=16):
+        self.mode = mode or os.environ.get(WIDGET_BUNDLE_ENV, "inline")
+        if self.mode not in ("inline", "url"):
+            raise ValueError(f"Unknown widget bundle mode: {self.mode!r}")
+        self.base_url = base_url or os.environ.get(WIDGET_BASE_URL_ENV)
+        # Bundle URL -> FigureWidget subclass importing it. Bounded, since without a base URL
+        # the URLs come from whatever addresses clients report.
+        self._classes = LRUCache(max_classes)
+
+    @property
+    def path(self):
+        # Versioned, so a new plotly release is never served from a stale browser cache
+        return f"widgets/plotly-{lazy_import('plotly').__version__}.js"
+
+    # A FigureWidget for the figure JSON; in url mode its bundle URL is under the configured base URL,
+    # or else built from the page's address, and a client that hasn't reported its address gets the bundle inline
+    def figure_widget(self, figure_dict, clientdata):
+        go = lazy_import("plotly.graph_objects")
+        if self.mode == "inline":
+            return go.FigureWidget(figure_dict)
+        if self.base_url:
+            url = f"{self.base_url.rstrip('/')}/{self.path}"
+        else:
+            try:
+                protocol, hostname, port, page = (
+                    clientdata.url_protocol(), clientdata.url_hostname(), clientdata.url_port(), clientdata.url_pathname()
+                )
+            except ValueError:  # Not reported by this client
+                return go.FigureWidget(figure_dict)
+            directory = page[:page.rfind("/") + 1] or "/"
+            url = f"{protocol}//{hostname}{f':{port}' if port else ''}{directory}{self.path}"
+        widget_class = self._classes.get_or_compute(
+            url, lambda: type("FigureWidget", (go.FigureWidget,), {"_esm": url, "__module__": __name__})
+        )
+        return widget_class(figure_dict)
+
+    # Starlette endpoint serving plotly's widget bundle at /widgets/<path>
+    async def endpoint(self, request):
+        from starlette.responses import FileResponse, Response
+
+        if request.path_params["name"] != os.path.basename(self.path):
+            return Response(status_code=404)
+        bundle = os.path.join(os.path.dirname(lazy_import("plotly").__file__), "package_data", "widgetbundle.js")
+        return FileResponse(bundle, media_type="text/javascript", headers={"Cache-Control": "public, max-age=31536000, immutable"})